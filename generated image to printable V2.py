@@ -1,258 +1,114 @@
 import tkinter as tk
 from tkinter import filedialog, colorchooser, messagebox, ttk
-from PIL import Image, ImageDraw
-import numpy as np
-from sklearn.cluster import DBSCAN
+from PIL import ImageTk
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
 import os
-import uuid
+import queue
+import threading
+
+from printable_core import (
+    DEFAULT_BILEVEL_THRESHOLD,
+    DEFAULT_EXPORT_PROFILE,
+    EXPORT_PROFILES,
+    PREVIEW_DEBOUNCE_MS,
+    TRIM_PADDING_PX,
+    check_cancelled,
+    decoded_cache,
+    detect_and_connect_image,
+    export_document,
+    OperationCancelled,
+    PageOverflowError,
+    pipeline_layout_a4_png,
+    render_preview_pages,
+    report_progress,
+    save_png_atomically,
+    stitch_images_from_paths,
+    StitchLayout,
+)
 
 
 # === UTILITY FUNCTIONS ===
-def cm_to_px(cm, dpi=300):
-    return int((cm / 2.54) * dpi)
-
-
-def flatten_transparency(img, background_color=(255, 255, 255)):
-    if img.mode == 'RGBA':
-        flattened = Image.new("RGB", img.size, background_color)
-        flattened.paste(img, mask=img.split()[3])
-        return flattened
-    return img.convert("RGB")
-
-
-# === CONNECTION FUNCTIONS ===
-def detect_and_connect_image(image, line_thickness, y_tolerance, line_color):
-    pixels = np.array(image)
-    yellow_mask = (
-        ((pixels[:, :, 0] >= 200) & (pixels[:, :, 0] <= 255))
-        & ((pixels[:, :, 1] >= 180) & (pixels[:, :, 1] <= 240))
-        & (pixels[:, :, 2] < 50)
-    )
-
-    ys, xs = np.where(yellow_mask)
-    points = list(zip(xs, ys))
-
-    centers = []
-    if points:
-        clustering = DBSCAN(eps=6, min_samples=3).fit(points)
-        labels = clustering.labels_
-        unique_labels = set(labels)
-        for label in unique_labels:
-            if label == -1:
-                continue
-            cluster_points = np.array([p for p, l in zip(points, labels) if l == label])
-            mean_x = int(np.mean(cluster_points[:, 0]))
-            mean_y = int(np.mean(cluster_points[:, 1]))
-            centers.append((mean_x, mean_y))
-
-    if not centers:
-        return image
-
-    centers_array = np.array(centers)
-    y_values = centers_array[:, 1].reshape(-1, 1)
-    eps = max(1, int(abs(y_tolerance)))
-    row_clustering = DBSCAN(eps=eps, min_samples=1).fit(y_values)
-    row_labels = row_clustering.labels_
-
-    draw_layer = Image.new("RGBA", image.size, (0, 0, 0, 0))
-    draw = ImageDraw.Draw(draw_layer)
-
-    # Group detected segments by row to draw a single horizontal guide per line
-    unique_rows = np.unique(row_labels)
-    for label in unique_rows:
-        if label == -1:
-            continue
-        row_points = centers_array[row_labels == label]
-        if len(row_points) < 2:
-            continue
-        line_y = int(np.median(row_points[:, 1]))
-        x_start = max(0, int(np.min(row_points[:, 0])) - line_thickness)
-        x_end = image.width - 1
-        draw.line([(x_start, line_y), (x_end, line_y)], fill=line_color + (255,), width=line_thickness)
-
-    return Image.alpha_composite(image, draw_layer)
-
-# === RESIZE & STITCH ===
-def resize_to_match_width(images, target_width):
-    resized_images = []
-    for img in images:
-        if img.width == target_width:
-            resized_images.append(img)
-            continue
-        padded = Image.new("RGBA", (target_width, img.height), (255, 255, 255, 0))
-        padded.paste(img, (0, 0))
-        resized_images.append(padded)
-    return resized_images
-
-
-def stitch_images_from_paths(file_paths, connect=False, overlap_px=0):
-    if not file_paths:
-        return None, "Warning: No images to stitch.", None
-    try:
-        images = [Image.open(f).convert("RGBA") for f in file_paths]
-        base_width = max(img.width for img in images)
-        resized_images = resize_to_match_width(images, base_width)
-
-        overlap_value = int(overlap_px)
-        y_offset = 0
-        segments = []
-        for idx, img in enumerate(resized_images):
-            segment_start = y_offset
-            segment_end = segment_start + img.height
-            segments.append((segment_start, segment_end, img))
-            y_offset = segment_end
-            if idx < len(resized_images) - 1:
-                effective_overlap = overlap_value
-                if effective_overlap > 0:
-                    effective_overlap = min(effective_overlap, img.height - 1)
-                y_offset -= effective_overlap
-                y_offset = max(0, y_offset)
-
-        total_height = max(end for _, end, _ in segments)
-        total_height = max(1, total_height)
-        stitched_img = Image.new("RGBA", (base_width, total_height))
-
-        segment_bounds = []
-        for segment_start, segment_end, img in segments:
-            stitched_img.paste(img, (0, segment_start))
-            segment_bounds.append((segment_start, segment_end))
-
-        if connect:
-            try:
-                thickness = int(thickness_entry.get())
-                tolerance = int(tolerance_entry.get())
-                r, g, b = map(int, color_entry.get().split(","))
-            except Exception:
-                return None, "Warning: Invalid line settings", None
-            stitched_img = detect_and_connect_image(stitched_img, thickness, tolerance, (r, g, b))
-
-        return stitched_img, None, segment_bounds
-
-    except Exception as e:
-        return None, f"Error: {e}", None
-
-
-# === FINAL FORMATTING ===
-def prepare_printable_a4(image, original_path, dpi=300):
-    a4_width_px = cm_to_px(21, dpi)
-    a4_height_px = cm_to_px(29.7, dpi)
-    margin_left = cm_to_px(0.4, dpi)
-    margin_right = cm_to_px(0.5, dpi)
-    margin_top = cm_to_px(2.0, dpi)
-
-    printable_width = a4_width_px - margin_left - margin_right
-
-    img = flatten_transparency(image)
-    img_width, img_height = img.size
-
-    if img_width > printable_width:
-        scale_factor = printable_width / img_width
-        new_width = printable_width
-        new_height = int(img_height * scale_factor)
-        img = img.resize((new_width, new_height), Image.LANCZOS)
-        img_width, img_height = img.size
-
-    available_height = a4_height_px - margin_top
-    if img_height > available_height:
-        messagebox.showerror("Too Tall", "Image too tall for A4 page with margins.")
-        return
+def printing_output_dir():
+    output_dir = os.path.join(os.path.expanduser("~"), "moodle-proxy", "Desktop", "for printing")
+    os.makedirs(output_dir, exist_ok=True)
+    return output_dir
 
-    canvas = Image.new("RGB", (a4_width_px, a4_height_px), "white")
-    canvas.paste(img, (margin_left, margin_top))
 
-    desktop_path = os.path.join(os.path.expanduser("~"), "moodle-proxy", "Desktop")
-    output_dir = os.path.join(desktop_path, "for printing")
-    os.makedirs(output_dir, exist_ok=True)
+# === BACKGROUND TASKS ===
+# Long actions run on a worker thread so the window stays responsive. The
+# worker only posts events to task_events; the Tk loop drains them with
+# root.after, so widgets are touched on the main thread alone. Cancel sets
+# the task's event; the run stops at the next segment or page and its
+# writers remove their temporary files.
+TASK_POLL_MS = 100
+task_events = queue.Queue()
+current_task = {"cancel_event": None}
 
-    unique_id = uuid.uuid4().hex[:8]
-    output_path = os.path.join(output_dir, f"output_{unique_id}_formatted.png")
-
-    canvas.save(output_path, dpi=(dpi, dpi))
-    messagebox.showinfo("Success", f"Saved printable A4 image:\n{output_path}")
-
-
-# === PDF EXPORT ===
-def generate_pdf_pages(image, segments, dpi=300):
-    a4_width_px = cm_to_px(21, dpi)
-    a4_height_px = cm_to_px(29.7, dpi)
-    margin_left = cm_to_px(0.4, dpi)
-    margin_right = cm_to_px(0.5, dpi)
-    margin_top = cm_to_px(2.0, dpi)
-
-    printable_width = a4_width_px - margin_left - margin_right
-    printable_height = a4_height_px - margin_top
-
-    img = flatten_transparency(image)
-    img_width, img_height = img.size
-
-    if not segments:
-        raise ValueError("No segment data available for pagination.")
-
-    scale_factor = 1.0
-    if img_width > printable_width:
-        scale_factor = printable_width / img_width
-        new_width = printable_width
-        new_height = int(round(img_height * scale_factor))
-        img = img.resize((new_width, new_height), Image.LANCZOS)
-        img_width, img_height = img.size
-        segments = [
-            (
-                int(round(start * scale_factor)),
-                int(round(end * scale_factor)),
-            )
-            for start, end in segments
-        ]
-    else:
-        segments = [(int(round(start)), int(round(end))) for start, end in segments]
-
-    img_height = img.size[1]
-    normalized_segments = []
-    for start, end in segments:
-        start = max(0, min(start, img_height))
-        end = max(0, min(end, img_height))
-        if end > start:
-            normalized_segments.append((start, end))
-    if not normalized_segments:
-        return []
-
-    pages_meta = []
-    page_start = None
-    page_end = None
-    current_segments = []
-
-    for start, end in normalized_segments:
-        segment_height = end - start
-        if segment_height > printable_height:
-            raise ValueError("A source image exceeds the printable height of the page.")
-        if page_start is None:
-            page_start = start
-            page_end = end
-            current_segments = [(start, end)]
-            continue
-
-        new_page_end = max(page_end, end)
-        if new_page_end - page_start <= printable_height:
-            current_segments.append((start, end))
-            page_end = new_page_end
+
+def start_task(work, on_success, description, on_error=None):
+    # work(progress, cancel_event) runs on the worker; on_success(result) and
+    # on_error(exception) run back on the Tk thread.
+    if current_task["cancel_event"] is not None:
+        status_var.set("Busy: wait for the current task or cancel it")
+        return
+    cancel_event = threading.Event()
+    current_task["cancel_event"] = cancel_event
+    set_task_running(True)
+    status_var.set(description)
+
+    def progress(stage, done, total):
+        task_events.put(("progress", f"{stage} {done}/{total}", None))
+
+    def runner():
+        try:
+            result = work(progress, cancel_event)
+        except OperationCancelled:
+            task_events.put(("cancelled", None, None))
+        except Exception as exc:
+            task_events.put(("error", exc, on_error))
         else:
-            pages_meta.append((page_start, page_end, current_segments))
-            page_start = start
-            page_end = end
-            current_segments = [(start, end)]
+            task_events.put(("done", result, on_success))
+
+    threading.Thread(target=runner, daemon=True).start()
+
+
+def cancel_task():
+    cancel_event = current_task["cancel_event"]
+    if cancel_event is not None:
+        cancel_event.set()
+        status_var.set("Cancelling...")
 
-    if current_segments:
-        pages_meta.append((page_start, page_end, current_segments))
 
-    pages = []
-    for page_start, _, segs in pages_meta:
-        canvas = Image.new("RGB", (a4_width_px, a4_height_px), "white")
-        for start, end in segs:
-            segment = img.crop((0, start, img_width, end))
-            offset_y = margin_top + (start - page_start)
-            canvas.paste(segment, (margin_left, int(offset_y)))
-        pages.append(canvas)
+def set_task_running(running):
+    for button in task_buttons:
+        button.state(["disabled"] if running else ["!disabled"])
+    cancel_button.state(["!disabled"] if running else ["disabled"])
 
-    return pages
+
+def poll_task_events():
+    try:
+        while True:
+            kind, payload, callback = task_events.get_nowait()
+            if kind == "progress":
+                cancel_event = current_task["cancel_event"]
+                if cancel_event is not None and not cancel_event.is_set():
+                    status_var.set(payload)
+                continue
+            current_task["cancel_event"] = None
+            set_task_running(False)
+            if kind == "cancelled":
+                status_var.set("Cancelled: no output was written")
+            elif kind == "error":
+                if callback is not None:
+                    callback(payload)
+                else:
+                    status_var.set(f"Error: {payload}")
+            else:
+                callback(payload)
+    except queue.Empty:
+        pass
+    root.after(TASK_POLL_MS, poll_task_events)
 
 
 # === GUI ACTIONS ===
@@ -271,6 +127,7 @@ def choose_color():
         color_entry.delete(0, tk.END)
         color_entry.insert(0, f"{r},{g},{b}")
         status_var.set("Updated connection color")
+        schedule_preview()
 
 
 def run_script():
@@ -285,16 +142,28 @@ def run_script():
     except Exception:
         status_var.set("Warning: Invalid input")
         return
-    image = Image.open(path).convert("RGBA")
-    result = detect_and_connect_image(image, thickness, tolerance, (r, g, b))
     base, _ = os.path.splitext(path)
     output_path = base + "_connected.png"
-    result.save(output_path)
-    try:
-        os.remove(path)
-        status_var.set(f"Success: Saved {output_path} and deleted original")
-    except Exception:
-        status_var.set(f"Success: Saved {output_path} but original could not be deleted")
+
+    def work(progress, cancel_event):
+        report_progress(progress, "Decoded", 0, 1)
+        # Lines are drawn in place, so work on a copy of the cached decode.
+        image = decoded_cache.get(path, remember=False).copy()
+        report_progress(progress, "Decoded", 1, 1)
+        check_cancelled(cancel_event)
+        result = detect_and_connect_image(image, thickness, tolerance, (r, g, b))
+        check_cancelled(cancel_event)
+        save_png_atomically(result, output_path)
+
+    def done(_):
+        # The original is removed on the Tk thread, once the result is saved.
+        try:
+            os.remove(path)
+            status_var.set(f"Success: Saved {output_path} and deleted original")
+        except Exception:
+            status_var.set(f"Success: Saved {output_path} but original could not be deleted")
+
+    start_task(work, done, "Connecting strokes...")
 
 
 def add_images_to_stitch():
@@ -309,6 +178,7 @@ def add_images_to_stitch():
             added += 1
     if added:
         status_var.set(f"Added {added} file(s) to stitch queue")
+        schedule_preview()
     else:
         status_var.set("Files already in the stitch queue")
 
@@ -320,6 +190,7 @@ def remove_selected_files():
     for index in reversed(selections):
         stitch_listbox.delete(index)
     status_var.set("Removed selected file(s) from queue")
+    schedule_preview()
 
 
 def run_stitch(connect=False, format_to_a4=False, to_pdf=False):
@@ -340,62 +211,188 @@ def stitch_and_save(connect=False, format_to_a4=False, to_pdf=False):
         status_var.set("Warning: Overlap cannot be negative; using 0")
         overlap_value = 0
 
-    result_img, error, segment_bounds = stitch_images_from_paths(
-        files, connect=connect, overlap_px=overlap_value
-    )
-    if error:
-        status_var.set(error)
+    color_mode = "L" if grayscale_var.get() else "RGBA"
+
+    trim_padding = None
+    if trim_var.get():
+        try:
+            trim_padding = max(0, int(trim_padding_entry.get()))
+        except (ValueError, TypeError):
+            status_var.set(f"Warning: Invalid trim padding; using {TRIM_PADDING_PX}")
+            trim_padding = TRIM_PADDING_PX
+
+    profile = EXPORT_PROFILE_LABELS.get(profile_var.get(), DEFAULT_EXPORT_PROFILE)
+    if to_pdf:
+        export_pdf(files, connect, overlap_value, color_mode, trim_padding, profile)
         return
-    if segment_bounds is None:
-        status_var.set("Error: Failed to compute segment layout.")
+    if format_to_a4:
+        export_a4_png(files, connect, overlap_value, color_mode, trim_padding, profile)
         return
 
+    line_settings = None
+    if connect:
+        line_settings = read_line_settings()
+        if line_settings is None:
+            status_var.set("Warning: Invalid line settings")
+            return
+    # Asked up front so the work can finish (or be cancelled) unattended.
+    save_path = filedialog.asksaveasfilename(defaultextension=".png", filetypes=[("PNG", "*.png")])
+    if not save_path:
+        return
+
+    def work(progress, cancel_event):
+        result_img, error, segment_bounds = stitch_images_from_paths(
+            files,
+            connect=connect,
+            overlap_px=overlap_value,
+            color_mode=color_mode,
+            trim_padding=trim_padding,
+            progress=progress,
+            cancel_event=cancel_event,
+            line_settings=line_settings,
+        )
+        if error:
+            return error
+        if segment_bounds is None:
+            return "Error: Failed to compute segment layout."
+        check_cancelled(cancel_event)
+        save_png_atomically(result_img, save_path)
+        return None
+
+    def done(error):
+        if error:
+            status_var.set(error)
+            return
+        delete_source_files(files)
+        status = "Connected and stitched" if connect else "Stitched"
+        status_var.set(f"Success: {status} image saved as {os.path.basename(save_path)}")
+
+    start_task(work, done, "Stitching...")
+
+
+PDF_COLOR_LABELS = {"Colour": "rgb", "Grayscale": "gray", "Black & White": "bilevel"}
+EXPORT_PROFILE_LABELS = {"Final (300 DPI)": "final", "Draft (150 DPI)": "draft"}
+
+
+def delete_source_files(files):
+    # Kept sources let a later rebuild reuse the stage cache instead of
+    # re-running the synthesis.
+    if keep_sources_var.get():
+        return
     for file_path in files:
         try:
             os.remove(file_path)
         except Exception:
             pass
 
-    if to_pdf:
-        pdf_name = pdf_name_entry.get().strip()
-        if not pdf_name:
-            status_var.set("Warning: Enter a PDF file name")
+
+def read_line_settings():
+    # (thickness, tolerance, colour) from the connection entries, or None.
+    try:
+        thickness = int(thickness_entry.get())
+        tolerance = int(tolerance_entry.get())
+        r, g, b = map(int, color_entry.get().split(","))
+    except Exception:
+        return None
+    return thickness, tolerance, (r, g, b)
+
+
+def export_a4_png(
+    files, connect, overlap_value, pipeline_mode="RGBA", trim_padding=None, profile=DEFAULT_EXPORT_PROFILE
+):
+    # Streams the queue onto one A4 page; sources are deleted only after the
+    # PNG has been written.
+    line_settings = None
+    if connect:
+        line_settings = read_line_settings()
+        if line_settings is None:
+            status_var.set("Warning: Invalid line settings")
             return
-        output_dir = os.path.join(
-            os.path.expanduser("~"), "moodle-proxy", "Desktop", "for printing"
+    output_dir = printing_output_dir()
+
+    def work(progress, cancel_event):
+        layout = StitchLayout(files, overlap_value, pipeline_mode, trim_padding)
+        check_cancelled(cancel_event)
+        # Named after its inputs and settings, so rebuilding the same page
+        # replaces the earlier file instead of adding another one.
+        build_key = repr((layout.content_key(), line_settings, profile)).encode()
+        build_id = hashlib.blake2b(build_key, digest_size=4).hexdigest()
+        suffix = "formatted" if profile == "final" else profile
+        output_path = os.path.join(output_dir, f"output_{build_id}_{suffix}.png")
+        return pipeline_layout_a4_png(
+            layout, output_path, line_settings, progress=progress, cancel_event=cancel_event, profile=profile
         )
-        os.makedirs(output_dir, exist_ok=True)
-        if not pdf_name.lower().endswith(".pdf"):
-            pdf_name += ".pdf"
-        save_path = os.path.join(output_dir, pdf_name)
-        try:
-            pages = generate_pdf_pages(result_img, segment_bounds, dpi=300)
-        except ValueError as err:
-            messagebox.showerror("Pagination Error", str(err))
-            status_var.set(f"Error: {err}")
-            return
-        if not pages:
-            status_var.set("Error: No printable pages generated")
+
+    def done(output_path):
+        delete_source_files(files)
+        messagebox.showinfo("Success", f"Saved printable A4 image:\n{output_path}")
+        status = "Connected, stitched" if connect else "Stitched"
+        status_var.set(f"Success: {status}, and formatted for A4 printing")
+
+    def failed(err):
+        if isinstance(err, PageOverflowError):
+            messagebox.showerror("Too Tall", str(err))
+        status_var.set(f"Error: {err}")
+
+    start_task(work, done, "Formatting for A4...", failed)
+
+
+def export_pdf(files, connect, overlap_value, pipeline_mode="RGBA", trim_padding=None, profile=DEFAULT_EXPORT_PROFILE):
+    # Pages are composed straight from the queued files, so they are only
+    # deleted once the PDF has been written.
+    pdf_name = pdf_name_entry.get().strip()
+    if not pdf_name:
+        status_var.set("Warning: Enter a PDF file name")
+        return
+    output_dir = printing_output_dir()
+    if not pdf_name.lower().endswith(".pdf"):
+        pdf_name += ".pdf"
+    save_path = os.path.join(output_dir, pdf_name)
+
+    color_mode = PDF_COLOR_LABELS.get(pdf_color_var.get(), "rgb")
+    try:
+        threshold = int(threshold_entry.get())
+    except (ValueError, TypeError):
+        status_var.set("Warning: Invalid threshold value")
+        return
+    if not 0 <= threshold <= 255:
+        status_var.set("Warning: Threshold must be between 0 and 255")
+        return
+
+    line_settings = None
+    if connect:
+        line_settings = read_line_settings()
+        if line_settings is None:
+            status_var.set("Warning: Invalid line settings")
             return
-        first_page, *remaining_pages = pages
-        first_page.save(
+
+    def work(progress, cancel_event):
+        return export_document(
+            files,
             save_path,
-            "PDF",
-            resolution=300.0,
-            save_all=True,
-            append_images=remaining_pages,
+            "pdf",
+            line_settings,
+            overlap_value,
+            pipeline_mode,
+            trim_padding,
+            pdf_color_mode=color_mode,
+            bilevel_threshold=threshold,
+            profile=profile,
+            progress=progress,
+            cancel_event=cancel_event,
         )
+
+    def done(page_count):
+        delete_source_files(files)
         messagebox.showinfo("Success", f"Saved PDF:\n{save_path}")
         status_var.set(f"Success: PDF saved as {os.path.basename(save_path)}")
-    elif format_to_a4:
-        prepare_printable_a4(result_img, files[0])
-        status_var.set("Success: Connected, stitched, and formatted for A4 printing")
-    else:
-        save_path = filedialog.asksaveasfilename(defaultextension=".png", filetypes=[("PNG", "*.png")])
-        if save_path:
-            result_img.save(save_path)
-            status = "Connected and stitched" if connect else "Stitched"
-            status_var.set(f"Success: {status} image saved as {os.path.basename(save_path)}")
+
+    def failed(err):
+        if isinstance(err, PageOverflowError):
+            messagebox.showerror("Pagination Error", str(err))
+        status_var.set(f"Error: {err}")
+
+    start_task(work, done, "Exporting PDF...", failed)
 
 
 def move_file(direction):
@@ -409,184 +406,337 @@ def move_file(direction):
             stitch_listbox.delete(index)
             stitch_listbox.insert(new_index, text)
             stitch_listbox.selection_set(new_index)
+    schedule_preview()
 
 
-# === GUI SETUP ===
-root = tk.Tk()
-root.title("Image Tools: Connect, Stitch, Format")
-root.minsize(760, 640)
-root.configure(bg="#f3f4f6")
-
-style = ttk.Style()
-try:
-    style.theme_use("clam")
-except tk.TclError:
-    pass
-
-style.configure("TFrame", background="#f3f4f6")
-style.configure("Card.TLabelframe", background="#ffffff", borderwidth=0)
-style.configure("Card.TLabelframe.Label", font=("Segoe UI", 12, "bold"))
-style.configure("Card.TFrame", background="#ffffff")
-style.configure("Accent.TButton", font=("Segoe UI", 10, "bold"), foreground="#ffffff")
-style.map(
-    "Accent.TButton",
-    background=[("!disabled", "#2563eb"), ("pressed", "#1d4ed8"), ("active", "#3b82f6")],
-    foreground=[("disabled", "#d1d5db"), ("!disabled", "#ffffff")]
-)
-style.configure("Secondary.TButton", font=("Segoe UI", 10), padding=6)
-style.map(
-    "Secondary.TButton",
-    background=[("!disabled", "#e5e7eb"), ("pressed", "#d1d5db"), ("active", "#dbeafe")]
-)
-style.configure("Status.TLabel", font=("Segoe UI", 10), background="#f3f4f6")
+# === PREVIEW PANE ===
+# Settings are read on the Tk thread and the pages rendered on a single
+# preview worker. Each refresh bumps the generation, so a render that
+# finishes after newer edits is dropped instead of shown.
+PREVIEW_POLL_MS = 10
+PREVIEW_PAGE_GAP = 10
+preview_executor = ThreadPoolExecutor(max_workers=1)
+preview_state = {"after_id": None, "generation": 0, "future": None, "photos": []}
 
-root.columnconfigure(0, weight=1)
-root.rowconfigure(0, weight=1)
 
-main_frame = ttk.Frame(root, padding=(20, 20, 20, 20))
-main_frame.grid(row=0, column=0, sticky="nsew")
-main_frame.columnconfigure(0, weight=1)
+def schedule_preview(*_):
+    if preview_state["after_id"] is not None:
+        root.after_cancel(preview_state["after_id"])
+    preview_state["after_id"] = root.after(PREVIEW_DEBOUNCE_MS, refresh_preview)
 
-header = ttk.Frame(main_frame, style="Card.TFrame", padding=(20, 15))
-header.grid(row=0, column=0, sticky="ew", pady=(0, 15))
-header.columnconfigure(0, weight=1)
 
-header_label = ttk.Label(
-    header,
-    text="MyText Handwriting Image Toolkit",
-    font=("Segoe UI", 18, "bold"),
-    background="#ffffff"
-)
-header_label.grid(row=0, column=0, sticky="w")
-
-subheader_label = ttk.Label(
-    header,
-    text="Connect yellow strokes, stitch exported lines, and format for A4 printing.",
-    font=("Segoe UI", 10),
-    foreground="#4b5563",
-    background="#ffffff"
-)
-subheader_label.grid(row=1, column=0, sticky="w", pady=(6, 0))
+def build_preview(files, overlap_value, color_mode, trim_padding, line_settings, dpi=300):
+    layout = StitchLayout(files, overlap_value, color_mode, trim_padding, remember_decoded=True)
+    if line_settings is not None:
+        layout.connect(*line_settings)
+    return render_preview_pages(layout, dpi=dpi)
 
-connect_section = ttk.LabelFrame(main_frame, text="Connect Yellow Lines", padding=15, style="Card.TLabelframe")
-connect_section.grid(row=1, column=0, sticky="nsew")
-connect_section.columnconfigure(1, weight=1)
 
-file_label = ttk.Label(connect_section, text="PNG File:")
-file_label.grid(row=0, column=0, sticky="e", pady=4, padx=(0, 10))
+def refresh_preview():
+    preview_state["after_id"] = None
+    preview_state["generation"] += 1
+    generation = preview_state["generation"]
+    # A render that has not started yet is superseded; drop it from the queue.
+    if preview_state["future"] is not None:
+        preview_state["future"].cancel()
+        preview_state["future"] = None
+    files = stitch_listbox.get(0, tk.END)
+    if not files:
+        show_preview_pages([])
+        return
+    try:
+        overlap_value = max(0, int(overlap_entry.get()))
+    except (ValueError, TypeError):
+        overlap_value = 0
+    trim_padding = None
+    if trim_var.get():
+        try:
+            trim_padding = max(0, int(trim_padding_entry.get()))
+        except (ValueError, TypeError):
+            trim_padding = TRIM_PADDING_PX
+    color_mode = "L" if grayscale_var.get() else "RGBA"
+    dpi = EXPORT_PROFILES[EXPORT_PROFILE_LABELS.get(profile_var.get(), DEFAULT_EXPORT_PROFILE)]["dpi"]
+    # Guides are drawn only while the connection settings parse.
+    future = preview_executor.submit(
+        build_preview, files, overlap_value, color_mode, trim_padding, read_line_settings(), dpi
+    )
+    preview_state["future"] = future
+    preview_info_var.set("Rendering preview...")
+
+    def check():
+        if generation != preview_state["generation"]:
+            return
+        if not future.done():
+            root.after(PREVIEW_POLL_MS, check)
+            return
+        try:
+            pages = future.result()
+        except Exception as exc:
+            preview_info_var.set(f"Preview unavailable: {exc}")
+            return
+        show_preview_pages(pages)
 
-file_entry = ttk.Entry(connect_section)
-file_entry.grid(row=0, column=1, sticky="ew", pady=4)
+    root.after(PREVIEW_POLL_MS, check)
 
-browse_button = ttk.Button(connect_section, text="Browse", command=browse_file, style="Secondary.TButton")
-browse_button.grid(row=0, column=2, padx=(10, 0), pady=4)
 
-thickness_label = ttk.Label(connect_section, text="Line Thickness (px):")
-thickness_label.grid(row=1, column=0, sticky="e", pady=4, padx=(0, 10))
+def show_preview_pages(pages):
+    preview_canvas.delete("all")
+    preview_state["photos"] = [ImageTk.PhotoImage(page) for page in pages]
+    y = PREVIEW_PAGE_GAP
+    width = 0
+    for photo in preview_state["photos"]:
+        preview_canvas.create_image(PREVIEW_PAGE_GAP, y, image=photo, anchor="nw")
+        y += photo.height() + PREVIEW_PAGE_GAP
+        width = max(width, photo.width())
+    preview_canvas.configure(scrollregion=(0, 0, width + 2 * PREVIEW_PAGE_GAP, y))
+    preview_info_var.set(f"{len(pages)} page(s)" if pages else "Add images to preview pages")
 
-thickness_entry = ttk.Entry(connect_section, width=8)
-thickness_entry.insert(0, "7")
-thickness_entry.grid(row=1, column=1, sticky="w", pady=4)
 
-tolerance_label = ttk.Label(connect_section, text="Vertical Tolerance (px):")
-tolerance_label.grid(row=2, column=0, sticky="e", pady=4, padx=(0, 10))
+# === GUI SETUP ===
+# Guarded so the window only opens when the script is run directly.
+if __name__ == "__main__":
+    root = tk.Tk()
+    root.title("Image Tools: Connect, Stitch, Format")
+    root.minsize(1040, 640)
+    root.configure(bg="#f3f4f6")
+
+    style = ttk.Style()
+    try:
+        style.theme_use("clam")
+    except tk.TclError:
+        pass
+
+    style.configure("TFrame", background="#f3f4f6")
+    style.configure("Card.TLabelframe", background="#ffffff", borderwidth=0)
+    style.configure("Card.TLabelframe.Label", font=("Segoe UI", 12, "bold"))
+    style.configure("Card.TFrame", background="#ffffff")
+    style.configure("Accent.TButton", font=("Segoe UI", 10, "bold"), foreground="#ffffff")
+    style.map(
+        "Accent.TButton",
+        background=[("!disabled", "#2563eb"), ("pressed", "#1d4ed8"), ("active", "#3b82f6")],
+        foreground=[("disabled", "#d1d5db"), ("!disabled", "#ffffff")]
+    )
+    style.configure("Secondary.TButton", font=("Segoe UI", 10), padding=6)
+    style.map(
+        "Secondary.TButton",
+        background=[("!disabled", "#e5e7eb"), ("pressed", "#d1d5db"), ("active", "#dbeafe")]
+    )
+    style.configure("Status.TLabel", font=("Segoe UI", 10), background="#f3f4f6")
+
+    root.columnconfigure(0, weight=1)
+    root.rowconfigure(0, weight=1)
+
+    main_frame = ttk.Frame(root, padding=(20, 20, 20, 20))
+    main_frame.grid(row=0, column=0, sticky="nsew")
+    main_frame.columnconfigure(0, weight=1)
+
+    header = ttk.Frame(main_frame, style="Card.TFrame", padding=(20, 15))
+    header.grid(row=0, column=0, columnspan=2, sticky="ew", pady=(0, 15))
+    header.columnconfigure(0, weight=1)
+
+    header_label = ttk.Label(
+        header,
+        text="MyText Handwriting Image Toolkit",
+        font=("Segoe UI", 18, "bold"),
+        background="#ffffff"
+    )
+    header_label.grid(row=0, column=0, sticky="w")
+
+    subheader_label = ttk.Label(
+        header,
+        text="Connect yellow strokes, stitch exported lines, and format for A4 printing.",
+        font=("Segoe UI", 10),
+        foreground="#4b5563",
+        background="#ffffff"
+    )
+    subheader_label.grid(row=1, column=0, sticky="w", pady=(6, 0))
+
+    connect_section = ttk.LabelFrame(main_frame, text="Connect Yellow Lines", padding=15, style="Card.TLabelframe")
+    connect_section.grid(row=1, column=0, sticky="nsew")
+    connect_section.columnconfigure(1, weight=1)
+
+    file_label = ttk.Label(connect_section, text="PNG File:")
+    file_label.grid(row=0, column=0, sticky="e", pady=4, padx=(0, 10))
+
+    file_entry = ttk.Entry(connect_section)
+    file_entry.grid(row=0, column=1, sticky="ew", pady=4)
+
+    browse_button = ttk.Button(connect_section, text="Browse", command=browse_file, style="Secondary.TButton")
+    browse_button.grid(row=0, column=2, padx=(10, 0), pady=4)
+
+    thickness_label = ttk.Label(connect_section, text="Line Thickness (px):")
+    thickness_label.grid(row=1, column=0, sticky="e", pady=4, padx=(0, 10))
+
+    thickness_entry = ttk.Entry(connect_section, width=8)
+    thickness_entry.insert(0, "7")
+    thickness_entry.grid(row=1, column=1, sticky="w", pady=4)
+
+    tolerance_label = ttk.Label(connect_section, text="Vertical Tolerance (px):")
+    tolerance_label.grid(row=2, column=0, sticky="e", pady=4, padx=(0, 10))
+
+    tolerance_entry = ttk.Entry(connect_section, width=8)
+    tolerance_entry.insert(0, "2")
+    tolerance_entry.grid(row=2, column=1, sticky="w", pady=4)
+
+    color_label = ttk.Label(connect_section, text="Line Color (R,G,B):")
+    color_label.grid(row=3, column=0, sticky="e", pady=4, padx=(0, 10))
+
+    color_entry = ttk.Entry(connect_section)
+    color_entry.insert(0, "0,0,0")
+    color_entry.grid(row=3, column=1, sticky="ew", pady=4)
+
+    color_button = ttk.Button(connect_section, text="Pick Color", command=choose_color, style="Secondary.TButton")
+    color_button.grid(row=3, column=2, padx=(10, 0), pady=4)
+
+    run_button = ttk.Button(connect_section, text="Connect Strokes", command=run_script, style="Accent.TButton")
+    run_button.grid(row=4, column=0, columnspan=3, pady=(12, 0))
+
+    stitch_section = ttk.LabelFrame(main_frame, text="Stitch & Export", padding=15, style="Card.TLabelframe")
+    stitch_section.grid(row=2, column=0, sticky="nsew", pady=(15, 0))
+    stitch_section.columnconfigure(0, weight=1)
+
+    instructions = ttk.Label(
+        stitch_section,
+        text="Queue PNG exports in order. Arrange them, set overlap, and export formatted pages or PDFs.",
+        foreground="#4b5563"
+    )
+    instructions.grid(row=0, column=0, columnspan=3, sticky="w", pady=(0, 8))
+
+    listbox_frame = ttk.Frame(stitch_section, style="Card.TFrame")
+    listbox_frame.grid(row=1, column=0, columnspan=3, sticky="nsew")
+    listbox_frame.columnconfigure(0, weight=1)
+
+    stitch_listbox = tk.Listbox(listbox_frame, height=8, activestyle="none", selectmode=tk.EXTENDED, borderwidth=0, highlightthickness=1)
+    stitch_listbox.grid(row=0, column=0, sticky="nsew")
+
+    scrollbar = ttk.Scrollbar(listbox_frame, orient="vertical", command=stitch_listbox.yview)
+    scrollbar.grid(row=0, column=1, sticky="ns")
+    stitch_listbox.configure(yscrollcommand=scrollbar.set)
+
+    settings_frame = ttk.Frame(stitch_section)
+    settings_frame.grid(row=2, column=0, sticky="ew", pady=(10, 0))
+    settings_frame.columnconfigure(3, weight=1)
 
-tolerance_entry = ttk.Entry(connect_section, width=8)
-tolerance_entry.insert(0, "2")
-tolerance_entry.grid(row=2, column=1, sticky="w", pady=4)
+    overlap_label = ttk.Label(settings_frame, text="Overlap (px):")
+    overlap_label.grid(row=0, column=0, sticky="e", padx=(0, 10))
 
-color_label = ttk.Label(connect_section, text="Line Color (R,G,B):")
-color_label.grid(row=3, column=0, sticky="e", pady=4, padx=(0, 10))
+    overlap_entry = ttk.Entry(settings_frame, width=8)
+    overlap_entry.insert(0, "0")
+    overlap_entry.grid(row=0, column=1, sticky="w")
 
-color_entry = ttk.Entry(connect_section)
-color_entry.insert(0, "0,0,0")
-color_entry.grid(row=3, column=1, sticky="ew", pady=4)
+    pdf_name_label = ttk.Label(settings_frame, text="PDF File Name:")
+    pdf_name_label.grid(row=0, column=2, sticky="e", padx=(20, 10))
 
-color_button = ttk.Button(connect_section, text="Pick Color", command=choose_color, style="Secondary.TButton")
-color_button.grid(row=3, column=2, padx=(10, 0), pady=4)
+    pdf_name_entry = ttk.Entry(settings_frame)
+    pdf_name_entry.insert(0, "handwriting.pdf")
+    pdf_name_entry.grid(row=0, column=3, sticky="ew")
 
-run_button = ttk.Button(connect_section, text="Connect Strokes", command=run_script, style="Accent.TButton")
-run_button.grid(row=4, column=0, columnspan=3, pady=(12, 0))
+    pdf_color_label = ttk.Label(settings_frame, text="PDF Colour:")
+    pdf_color_label.grid(row=1, column=0, sticky="e", padx=(0, 10), pady=(8, 0))
 
-stitch_section = ttk.LabelFrame(main_frame, text="Stitch & Export", padding=15, style="Card.TLabelframe")
-stitch_section.grid(row=2, column=0, sticky="nsew", pady=(15, 0))
-stitch_section.columnconfigure(0, weight=1)
+    pdf_color_var = tk.StringVar(value="Colour")
+    pdf_color_combo = ttk.Combobox(
+        settings_frame, textvariable=pdf_color_var, values=list(PDF_COLOR_LABELS), state="readonly", width=14
+    )
+    pdf_color_combo.grid(row=1, column=1, sticky="w", pady=(8, 0))
 
-instructions = ttk.Label(
-    stitch_section,
-    text="Queue PNG exports in order. Arrange them, set overlap, and export formatted pages or PDFs.",
-    foreground="#4b5563"
-)
-instructions.grid(row=0, column=0, columnspan=3, sticky="w", pady=(0, 8))
-
-listbox_frame = ttk.Frame(stitch_section, style="Card.TFrame")
-listbox_frame.grid(row=1, column=0, columnspan=3, sticky="nsew")
-listbox_frame.columnconfigure(0, weight=1)
+    threshold_label = ttk.Label(settings_frame, text="B&W Threshold:")
+    threshold_label.grid(row=1, column=2, sticky="e", padx=(20, 10), pady=(8, 0))
+
+    threshold_entry = ttk.Entry(settings_frame, width=8)
+    threshold_entry.insert(0, str(DEFAULT_BILEVEL_THRESHOLD))
+    threshold_entry.grid(row=1, column=3, sticky="w", pady=(8, 0))
+
+    grayscale_var = tk.BooleanVar(value=False)
+    grayscale_check = ttk.Checkbutton(settings_frame, text="Grayscale pipeline", variable=grayscale_var)
+    grayscale_check.grid(row=2, column=1, sticky="w", pady=(8, 0))
+
+    trim_var = tk.BooleanVar(value=False)
+    trim_check = ttk.Checkbutton(settings_frame, text="Trim margins, padding (px):", variable=trim_var)
+    trim_check.grid(row=2, column=2, sticky="e", padx=(20, 10), pady=(8, 0))
+
+    trim_padding_entry = ttk.Entry(settings_frame, width=8)
+    trim_padding_entry.insert(0, str(TRIM_PADDING_PX))
+    trim_padding_entry.grid(row=2, column=3, sticky="w", pady=(8, 0))
+
+    keep_sources_var = tk.BooleanVar(value=False)
+    keep_sources_check = ttk.Checkbutton(settings_frame, text="Keep source files", variable=keep_sources_var)
+    keep_sources_check.grid(row=3, column=1, sticky="w", pady=(8, 0))
 
-stitch_listbox = tk.Listbox(listbox_frame, height=8, activestyle="none", selectmode=tk.EXTENDED, borderwidth=0, highlightthickness=1)
-stitch_listbox.grid(row=0, column=0, sticky="nsew")
+    profile_label = ttk.Label(settings_frame, text="Export Profile:")
+    profile_label.grid(row=3, column=2, sticky="e", padx=(20, 10), pady=(8, 0))
 
-scrollbar = ttk.Scrollbar(listbox_frame, orient="vertical", command=stitch_listbox.yview)
-scrollbar.grid(row=0, column=1, sticky="ns")
-stitch_listbox.configure(yscrollcommand=scrollbar.set)
+    profile_var = tk.StringVar(value="Final (300 DPI)")
+    profile_combo = ttk.Combobox(
+        settings_frame, textvariable=profile_var, values=list(EXPORT_PROFILE_LABELS), state="readonly", width=14
+    )
+    profile_combo.grid(row=3, column=3, sticky="w", pady=(8, 0))
 
-settings_frame = ttk.Frame(stitch_section)
-settings_frame.grid(row=2, column=0, sticky="ew", pady=(10, 0))
-settings_frame.columnconfigure(3, weight=1)
+    controls_frame = ttk.Frame(stitch_section)
+    controls_frame.grid(row=3, column=0, sticky="ew", pady=12)
+    controls_frame.columnconfigure(4, weight=1)
 
-overlap_label = ttk.Label(settings_frame, text="Overlap (px):")
-overlap_label.grid(row=0, column=0, sticky="e", padx=(0, 10))
+    add_button = ttk.Button(controls_frame, text="Add Images", command=add_images_to_stitch, style="Secondary.TButton")
+    add_button.grid(row=0, column=0, padx=(0, 6))
 
-overlap_entry = ttk.Entry(settings_frame, width=8)
-overlap_entry.insert(0, "0")
-overlap_entry.grid(row=0, column=1, sticky="w")
+    remove_button = ttk.Button(controls_frame, text="Remove Selected", command=remove_selected_files, style="Secondary.TButton")
+    remove_button.grid(row=0, column=1, padx=6)
 
-pdf_name_label = ttk.Label(settings_frame, text="PDF File Name:")
-pdf_name_label.grid(row=0, column=2, sticky="e", padx=(20, 10))
+    up_button = ttk.Button(controls_frame, text="Move Up", command=lambda: move_file(-1), style="Secondary.TButton")
+    up_button.grid(row=0, column=2, padx=6)
 
-pdf_name_entry = ttk.Entry(settings_frame)
-pdf_name_entry.insert(0, "handwriting.pdf")
-pdf_name_entry.grid(row=0, column=3, sticky="ew")
+    down_button = ttk.Button(controls_frame, text="Move Down", command=lambda: move_file(1), style="Secondary.TButton")
+    down_button.grid(row=0, column=3, padx=6)
 
-controls_frame = ttk.Frame(stitch_section)
-controls_frame.grid(row=3, column=0, sticky="ew", pady=12)
-controls_frame.columnconfigure(4, weight=1)
+    buttons_frame = ttk.Frame(stitch_section)
+    buttons_frame.grid(row=4, column=0, sticky="ew")
+    buttons_frame.columnconfigure((0, 1, 2, 3), weight=1)
 
-add_button = ttk.Button(controls_frame, text="Add Images", command=add_images_to_stitch, style="Secondary.TButton")
-add_button.grid(row=0, column=0, padx=(0, 6))
+    stitch_button = ttk.Button(buttons_frame, text="Stitch & Save", command=lambda: run_stitch(False, False, False), style="Accent.TButton")
+    stitch_button.grid(row=0, column=0, sticky="ew", padx=(0, 6))
 
-remove_button = ttk.Button(controls_frame, text="Remove Selected", command=remove_selected_files, style="Secondary.TButton")
-remove_button.grid(row=0, column=1, padx=6)
+    connect_stitch_button = ttk.Button(buttons_frame, text="Stitch & Connect", command=lambda: run_stitch(True, False, False), style="Accent.TButton")
+    connect_stitch_button.grid(row=0, column=1, sticky="ew", padx=6)
 
-up_button = ttk.Button(controls_frame, text="Move Up", command=lambda: move_file(-1), style="Secondary.TButton")
-up_button.grid(row=0, column=2, padx=6)
+    full_process_button = ttk.Button(buttons_frame, text="Connect + Stitch + Format", command=lambda: run_stitch(True, True, False), style="Accent.TButton")
+    full_process_button.grid(row=0, column=2, sticky="ew", padx=6)
 
-down_button = ttk.Button(controls_frame, text="Move Down", command=lambda: move_file(1), style="Secondary.TButton")
-down_button.grid(row=0, column=3, padx=6)
+    pdf_button = ttk.Button(buttons_frame, text="Connect + Stitch + PDF", command=lambda: run_stitch(True, False, True), style="Accent.TButton")
+    pdf_button.grid(row=0, column=3, sticky="ew", padx=(6, 0))
 
-buttons_frame = ttk.Frame(stitch_section)
-buttons_frame.grid(row=4, column=0, sticky="ew")
-buttons_frame.columnconfigure((0, 1, 2, 3), weight=1)
+    cancel_button = ttk.Button(buttons_frame, text="Cancel", command=cancel_task, style="Secondary.TButton")
+    cancel_button.grid(row=1, column=0, columnspan=4, sticky="ew", pady=(8, 0))
+    cancel_button.state(["disabled"])
 
-stitch_button = ttk.Button(buttons_frame, text="Stitch & Save", command=lambda: run_stitch(False, False, False), style="Accent.TButton")
-stitch_button.grid(row=0, column=0, sticky="ew", padx=(0, 6))
+    task_buttons = [run_button, stitch_button, connect_stitch_button, full_process_button, pdf_button]
 
-connect_stitch_button = ttk.Button(buttons_frame, text="Stitch & Connect", command=lambda: run_stitch(True, False, False), style="Accent.TButton")
-connect_stitch_button.grid(row=0, column=1, sticky="ew", padx=6)
+    preview_section = ttk.LabelFrame(main_frame, text="Preview", padding=15, style="Card.TLabelframe")
+    preview_section.grid(row=1, column=1, rowspan=2, sticky="nsew", padx=(15, 0))
+    preview_section.columnconfigure(0, weight=1)
+    preview_section.rowconfigure(0, weight=1)
 
-full_process_button = ttk.Button(buttons_frame, text="Connect + Stitch + Format", command=lambda: run_stitch(True, True, False), style="Accent.TButton")
-full_process_button.grid(row=0, column=2, sticky="ew", padx=6)
+    preview_canvas = tk.Canvas(preview_section, width=240, background="#e5e7eb", borderwidth=0, highlightthickness=0)
+    preview_canvas.grid(row=0, column=0, sticky="nsew")
 
-pdf_button = ttk.Button(buttons_frame, text="Connect + Stitch + PDF", command=lambda: run_stitch(True, False, True), style="Accent.TButton")
-pdf_button.grid(row=0, column=3, sticky="ew", padx=(6, 0))
+    preview_scrollbar = ttk.Scrollbar(preview_section, orient="vertical", command=preview_canvas.yview)
+    preview_scrollbar.grid(row=0, column=1, sticky="ns")
+    preview_canvas.configure(yscrollcommand=preview_scrollbar.set)
 
-status_var = tk.StringVar(value="Ready")
-status_label = ttk.Label(main_frame, textvariable=status_var, style="Status.TLabel")
-status_label.grid(row=3, column=0, sticky="w", pady=(15, 0))
+    preview_info_var = tk.StringVar(value="Add images to preview pages")
+    preview_info_label = ttk.Label(preview_section, textvariable=preview_info_var, foreground="#4b5563")
+    preview_info_label.grid(row=1, column=0, columnspan=2, sticky="w", pady=(8, 0))
 
-footer = ttk.Label(main_frame, text="Optimised for MyText handwriting exports by Thaines", font=("Segoe UI", 9), foreground="#6b7280")
-footer.grid(row=4, column=0, sticky="w", pady=(6, 0))
+    for entry in (thickness_entry, tolerance_entry, color_entry, overlap_entry, trim_padding_entry):
+        entry.bind("<KeyRelease>", schedule_preview)
+    for variable in (grayscale_var, trim_var, profile_var):
+        variable.trace_add("write", schedule_preview)
 
-root.mainloop()
+    status_var = tk.StringVar(value="Ready")
+    status_label = ttk.Label(main_frame, textvariable=status_var, style="Status.TLabel")
+    status_label.grid(row=3, column=0, columnspan=2, sticky="w", pady=(15, 0))
 
+    footer = ttk.Label(main_frame, text="Optimised for MyText handwriting exports by Thaines", font=("Segoe UI", 9), foreground="#6b7280")
+    footer.grid(row=4, column=0, columnspan=2, sticky="w", pady=(6, 0))
 
+    root.after(TASK_POLL_MS, poll_task_events)
+    root.mainloop()
@@ -0,0 +1,178 @@
+# Command-line front end for printable_core, for running the print pipeline
+# without a display.
+#
+#   python printable_cli.py line_1.png line_2.png -o essay.pdf
+#   python printable_cli.py "exports/*.png" -o essay.png --draft
+#   python printable_cli.py --batch exports/essay1 exports/essay2 --output-dir out --jobs 4
+#
+# Inputs are files, directories or quoted globs. Directories and globs expand
+# in natural order (line_2 before line_10). With --batch each input is its own
+# document, and documents run in parallel in a process pool. Exits 1 if any
+# document fails and 2 on bad arguments.
+import argparse
+import glob
+import os
+import re
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+from printable_core import (
+    DEFAULT_BILEVEL_THRESHOLD,
+    DEFAULT_LINE_SETTINGS,
+    EXPORT_FORMATS,
+    EXPORT_PROFILES,
+    PDF_COLOR_MODES,
+    configure_one_shot_caches,
+    export_document,
+)
+
+
+def natural_key(path):
+    return [int(part) if part.isdigit() else part.lower() for part in re.split(r"(\d+)", os.path.basename(path))]
+
+
+def expand_input(pattern):
+    # The PNGs one command-line input names, in natural order for directories
+    # and globs.
+    if os.path.isdir(pattern):
+        paths = [entry.path for entry in os.scandir(pattern) if entry.name.lower().endswith(".png")]
+    elif glob.has_magic(pattern):
+        paths = [path for path in glob.glob(pattern) if os.path.isfile(path)]
+    elif os.path.isfile(pattern):
+        return [pattern]
+    else:
+        raise ValueError(f"No such file or directory: {pattern}")
+    if not paths:
+        raise ValueError(f"No PNG files match: {pattern}")
+    return sorted(paths, key=natural_key)
+
+
+def parse_color(text):
+    try:
+        r, g, b = (int(part) for part in text.split(","))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected R,G,B, got {text!r}")
+    if not all(0 <= value <= 255 for value in (r, g, b)):
+        raise argparse.ArgumentTypeError(f"colour values must be 0-255, got {text!r}")
+    return r, g, b
+
+
+def document_name(pattern):
+    name = os.path.basename(os.path.normpath(pattern.split("*")[0])) or "document"
+    return os.path.splitext(name)[0]
+
+
+def build_parser():
+    thickness, tolerance, color = DEFAULT_LINE_SETTINGS
+    parser = argparse.ArgumentParser(description="Stitch handwriting line PNGs into a printable PDF or A4 PNG.")
+    parser.add_argument("inputs", nargs="+", help="PNG files, directories or quoted globs")
+    parser.add_argument("-o", "--output", help="output file for a single document (.pdf or .png)")
+    parser.add_argument("--batch", action="store_true", help="treat each input as a separate document")
+    parser.add_argument("--output-dir", help="directory for --batch outputs")
+    parser.add_argument("--format", choices=EXPORT_FORMATS, help="output format (default: from -o, else pdf)")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1, help="documents processed at once")
+    parser.add_argument("--no-connect", action="store_true", help="stitch without drawing guide lines")
+    parser.add_argument("--thickness", type=int, default=thickness, help="guide line thickness in px")
+    parser.add_argument("--tolerance", type=int, default=tolerance, help="vertical tolerance for guide rows in px")
+    parser.add_argument("--color", type=parse_color, default=color, help="guide line colour as R,G,B")
+    parser.add_argument("--overlap", type=int, default=0, help="overlap between lines in px")
+    parser.add_argument("--grayscale", action="store_true", help="run the pipeline in grayscale")
+    parser.add_argument("--trim", type=int, metavar="PADDING", help="trim line margins, keeping PADDING px")
+    parser.add_argument("--pdf-color", choices=PDF_COLOR_MODES, default="rgb", help="PDF image colour mode")
+    parser.add_argument("--threshold", type=int, default=DEFAULT_BILEVEL_THRESHOLD, help="bilevel PDF threshold")
+    parser.add_argument("--profile", choices=sorted(EXPORT_PROFILES), default="final", help="export profile")
+    parser.add_argument("--draft", dest="profile", action="store_const", const="draft", help="same as --profile draft")
+    return parser
+
+
+def plan_documents(args, parser):
+    # [(file paths, output path)] for the parsed arguments.
+    if args.batch and args.output:
+        parser.error("-o/--output names a single document; use --output-dir with --batch")
+    if not args.batch and args.output_dir:
+        parser.error("--output-dir only applies with --batch; use -o/--output for a single document")
+    output_format = args.format
+    if args.output:
+        extension = os.path.splitext(args.output)[1].lower().lstrip(".")
+        if extension not in EXPORT_FORMATS:
+            parser.error(f"-o/--output must end in .pdf or .png, got {args.output!r}")
+        if output_format is not None and output_format != extension:
+            parser.error(f"--format {output_format} does not match {args.output!r}")
+        output_format = extension
+    output_format = output_format or "pdf"
+
+    if not args.batch:
+        if not args.output:
+            parser.error("-o/--output is required without --batch")
+        paths = [path for pattern in args.inputs for path in expand_input(pattern)]
+        return output_format, [(paths, args.output)]
+
+    if not args.output_dir:
+        parser.error("--output-dir is required with --batch")
+    os.makedirs(args.output_dir, exist_ok=True)
+    documents = []
+    for pattern in args.inputs:
+        output_path = os.path.join(args.output_dir, f"{document_name(pattern)}.{output_format}")
+        if any(output_path == existing for _, existing in documents):
+            parser.error(f"two inputs would both write {output_path}")
+        documents.append((expand_input(pattern), output_path))
+    return output_format, documents
+
+
+def run_document(paths, output_path, settings):
+    # Runs in a pool worker; returns a one-line summary.
+    result = export_document(paths, output_path, **settings)
+    if settings["output_format"] == "pdf":
+        return f"{output_path}: {len(paths)} line(s), {result} page(s)"
+    return f"{output_path}: {len(paths)} line(s)"
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+    try:
+        output_format, documents = plan_documents(args, parser)
+    except ValueError as exc:
+        parser.error(str(exc))
+
+    configure_one_shot_caches()
+    settings = {
+        "output_format": output_format,
+        "line_settings": None if args.no_connect else (args.thickness, args.tolerance, args.color),
+        "overlap_px": max(0, args.overlap),
+        "color_mode": "L" if args.grayscale else "RGBA",
+        "trim_padding": None if args.trim is None else max(0, args.trim),
+        "pdf_color_mode": args.pdf_color,
+        "bilevel_threshold": args.threshold,
+        "profile": args.profile,
+    }
+
+    failures = 0
+    if len(documents) == 1 or args.jobs == 1:
+        for paths, output_path in documents:
+            try:
+                print(run_document(paths, output_path, settings))
+            except Exception as exc:
+                failures += 1
+                print(f"error: {output_path}: {exc}", file=sys.stderr)
+    else:
+        with ProcessPoolExecutor(
+            max_workers=min(args.jobs, len(documents)), initializer=configure_one_shot_caches
+        ) as pool:
+            futures = [
+                (output_path, pool.submit(run_document, paths, output_path, settings))
+                for paths, output_path in documents
+            ]
+            for output_path, future in futures:
+                try:
+                    print(future.result())
+                except Exception as exc:
+                    failures += 1
+                    print(f"error: {output_path}: {exc}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,2513 @@
+# Widget-free core of the print pipeline: guide detection, stitching,
+# pagination and the PDF/PNG writers. The Tk front end in
+# "generated image to printable V2.py" and printable_cli.py are built on it.
+from PIL import Image, features
+import numpy as np
+from sklearn.cluster import DBSCAN
+from scipy import ndimage
+from scipy.spatial import cKDTree
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import hashlib
+import io
+import os
+import queue
+import threading
+import zlib
+
+
+# === UTILITY FUNCTIONS ===
+def cm_to_px(cm, dpi=300):
+    return int((cm / 2.54) * dpi)
+
+
+def save_png_atomically(image, path):
+    # Written next to the target and renamed, so a failed or cancelled save
+    # never leaves a partial file behind.
+    temp_path = path + ".part"
+    try:
+        image.save(temp_path, format="PNG")
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+
+
+def flatten_transparency(img, background_color=(255, 255, 255)):
+    if img.mode == 'RGBA':
+        flattened = Image.new("RGB", img.size, background_color)
+        flattened.paste(img, mask=img.split()[3])
+        return flattened
+    if img.mode in ("L", "LA"):
+        return to_pipeline_mode(img, "L", background_color)
+    return img.convert("RGB")
+
+
+# Pipeline colour modes: "RGBA" keeps colour and transparency end to end, "L"
+# flattens each line onto white as soon as its guide dots have been read and
+# carries 1 byte per pixel through stitching, pagination and export.
+PIPELINE_MODES = ("RGBA", "L")
+
+
+def to_pipeline_mode(img, mode, background_color=(255, 255, 255)):
+    if img.mode == mode:
+        return img
+    if mode == "RGBA":
+        return img.convert("RGBA")
+    if img.mode in ("RGBA", "LA", "PA") or "transparency" in img.info:
+        rgba = img.convert("RGBA")
+        flattened = Image.new("RGB", img.size, background_color)
+        flattened.paste(rgba, mask=rgba.getchannel("A"))
+        return flattened.convert("L")
+    return img.convert("L")
+
+
+def blank_canvas(mode, size):
+    # Empty stitched area: transparent in RGBA, already-flattened white in L.
+    if mode == "L":
+        return Image.new("L", size, 255)
+    return Image.new("RGBA", size)
+
+
+# === STAGE CACHE ===
+# Results of the expensive stages after decoding (dot pixels, ink boxes,
+# scaled page regions and encoded PDF pages) are kept in one LRU keyed by the
+# content hash of the input files plus every parameter the stage depends on,
+# so a rebuild after a thickness change, a re-synthesised line or a new file
+# name only recomputes what actually changed. The cache is bounded by the
+# approximate bytes its entries hold.
+STAGE_CACHE_BYTES = 768 * 1024 * 1024
+CONTENT_DIGEST_CACHE_SIZE = 4096
+
+
+class StageCache:
+    def __init__(self, max_bytes=STAGE_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return self._entries[key][0]
+
+    def put(self, key, value, size):
+        # Entries larger than the whole budget are not kept.
+        with self._lock:
+            if key in self._entries:
+                self.current_bytes -= self._entries.pop(key)[1]
+            if size > self.max_bytes:
+                return value
+            self._entries[key] = (value, size)
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.current_bytes -= evicted_size
+        return value
+
+    def configure(self, max_bytes):
+        with self._lock:
+            self.max_bytes = max(0, int(max_bytes))
+            while self.current_bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.current_bytes -= evicted_size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+
+stage_cache = StageCache()
+_content_digests = OrderedDict()
+_content_digests_lock = threading.Lock()
+
+
+def _file_signature(path):
+    stat = os.stat(path)
+    return (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+
+
+def content_digest(path):
+    # Hash of the file's bytes, remembered per (path, mtime, size) so each
+    # file version is read once.
+    signature = _file_signature(path)
+    with _content_digests_lock:
+        if signature in _content_digests:
+            _content_digests.move_to_end(signature)
+            return _content_digests[signature]
+    with open(path, "rb") as handle:
+        digest = hashlib.blake2b(handle.read(), digest_size=16).hexdigest()
+    with _content_digests_lock:
+        _content_digests[signature] = digest
+        while len(_content_digests) > CONTENT_DIGEST_CACHE_SIZE:
+            _content_digests.popitem(last=False)
+    return digest
+
+
+def image_nbytes(image):
+    return image.width * image.height * len(image.getbands())
+
+
+# === DECODED IMAGE CACHE ===
+# Every tool decodes the same line PNGs, so decoded images are cached in the
+# pipeline mode they are used in (1 byte per pixel in "L") and keyed by
+# (path, mtime, size, mode). There are two tiers. The in-process LRU is
+# bounded in bytes and only filled by callers passing remember=True, which is
+# the interactive preview; streaming exports read each file once and only
+# look images up. The disk tier holds .npy files that are memory-mapped back
+# (no inflate, no copy; the image is read-only and Pillow copies it on first
+# write). They are several hundred times the PNG size, so an image is only
+# written there the second time it has to be decoded. The policy decides what
+# an eviction drops: "lru" the least recently used entry, "fifo" the oldest
+# stored one. Sizes and policy can be changed with configure(); tools that
+# export once (the CLI, the watch folder) call configure_one_shot_caches().
+# Returned images are shared, so callers copy before drawing on them.
+DECODED_CACHE_MEMORY_BYTES = 512 * 1024 * 1024
+DECODED_CACHE_DISK_BYTES = 2 * 1024 * 1024 * 1024
+DECODED_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "printable-toolkit", "decoded")
+DECODED_CACHE_SEEN_SIZE = 4096
+CACHE_POLICIES = ("lru", "fifo")
+
+
+class DecodedImageCache:
+    def __init__(
+        self,
+        memory_bytes=DECODED_CACHE_MEMORY_BYTES,
+        disk_bytes=DECODED_CACHE_DISK_BYTES,
+        directory=DECODED_CACHE_DIR,
+        policy="lru",
+    ):
+        self.memory_bytes = 0
+        self.disk_bytes = 0
+        self.directory = None
+        self.policy = "lru"
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.memory_used = 0
+        self._entries = OrderedDict()
+        # Keys decoded once already; a second decode goes to disk.
+        self._seen = OrderedDict()
+        self._lock = threading.Lock()
+        self.configure(memory_bytes, disk_bytes, directory, policy)
+
+    def configure(self, memory_bytes=None, disk_bytes=None, directory=None, policy=None):
+        # Changes the given settings; a smaller memory budget evicts at once.
+        if policy is not None and policy not in CACHE_POLICIES:
+            raise ValueError(f"Unknown cache policy: {policy}")
+        with self._lock:
+            if memory_bytes is not None:
+                self.memory_bytes = max(0, int(memory_bytes))
+            if disk_bytes is not None:
+                self.disk_bytes = max(0, int(disk_bytes))
+            if directory is not None:
+                self.directory = directory
+            if policy is not None:
+                self.policy = policy
+            self._evict_memory()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "memory_entries": len(self._entries),
+                "memory_used": self.memory_used,
+            }
+
+    def get(self, path, mode="RGBA", remember=True, decoded=None):
+        # path in a pipeline mode, from memory, disk or the PNG itself;
+        # decoded is the RGBA decode when the caller already holds it.
+        key = _file_signature(path) + (mode,)
+        with self._lock:
+            if key in self._entries:
+                self.memory_hits += 1
+                if self.policy == "lru":
+                    self._entries.move_to_end(key)
+                return self._entries[key][0]
+        image = self._load_from_disk(key)
+        if image is not None:
+            with self._lock:
+                self.disk_hits += 1
+        else:
+            if decoded is None:
+                with Image.open(path) as source:
+                    decoded = source.convert("RGBA")
+            image = to_pipeline_mode(decoded, mode)
+            with self._lock:
+                self.misses += 1
+                seen_before = key in self._seen
+                self._seen[key] = True
+                while len(self._seen) > DECODED_CACHE_SEEN_SIZE:
+                    self._seen.popitem(last=False)
+            if seen_before:
+                self._store_on_disk(key, image)
+        if remember:
+            self._remember(key, image)
+        return image
+
+    def clear(self, disk=False):
+        with self._lock:
+            self._entries.clear()
+            self._seen.clear()
+            self.memory_used = 0
+        if disk and self.directory and os.path.isdir(self.directory):
+            for entry in os.scandir(self.directory):
+                if entry.name.endswith(".npy"):
+                    try:
+                        os.remove(entry.path)
+                    except OSError:
+                        pass
+
+    def _remember(self, key, image):
+        size = image_nbytes(image)
+        with self._lock:
+            if key in self._entries or size > self.memory_bytes:
+                return
+            self._entries[key] = (image, size)
+            self.memory_used += size
+            self._evict_memory()
+
+    def _evict_memory(self):
+        # Called with the lock held.
+        while self.memory_used > self.memory_bytes:
+            _, (_, evicted_size) = self._entries.popitem(last=False)
+            self.memory_used -= evicted_size
+
+    def _disk_path(self, key):
+        name = hashlib.blake2b(repr(key).encode(), digest_size=16).hexdigest()
+        return os.path.join(self.directory, name + ".npy")
+
+    def _load_from_disk(self, key):
+        if not self.directory or self.disk_bytes <= 0:
+            return None
+        disk_path = self._disk_path(key)
+        try:
+            pixels = np.load(disk_path, mmap_mode="r")
+            if self.policy == "lru":
+                os.utime(disk_path)
+        except (OSError, ValueError):
+            return None
+        mode = key[-1]
+        height, width = pixels.shape[:2]
+        return Image.frombuffer(mode, (width, height), pixels, "raw", mode, 0, 1)
+
+    def _store_on_disk(self, key, image):
+        if not self.directory or self.disk_bytes <= 0 or image_nbytes(image) > self.disk_bytes:
+            return
+        disk_path = self._disk_path(key)
+        temp_path = f"{disk_path}.{os.getpid()}.{threading.get_ident()}.part"
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(temp_path, "wb") as handle:
+                np.save(handle, np.asarray(image))
+            os.replace(temp_path, disk_path)
+        except OSError:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            return
+        self._evict_disk()
+
+    def _evict_disk(self):
+        # The modification time is the last use under "lru" (hits touch the
+        # file) and the store time under "fifo".
+        try:
+            entries = [entry for entry in os.scandir(self.directory) if entry.name.endswith(".npy")]
+            files = [(entry.stat().st_mtime_ns, entry.stat().st_size, entry.path) for entry in entries]
+        except OSError:
+            return
+        total = sum(size for _, size, _ in files)
+        for _, size, file_path in sorted(files):
+            if total <= self.disk_bytes:
+                break
+            try:
+                os.remove(file_path)
+                total -= size
+            except OSError:
+                pass
+
+
+decoded_cache = DecodedImageCache()
+
+# A one-shot export decodes each file once and never comes back to it, so it
+# keeps no decoded images and only enough stage cache for the small per-file
+# results (dot pixels, ink boxes) and the encoded lines that run onto a
+# second page.
+ONE_SHOT_STAGE_CACHE_BYTES = 64 * 1024 * 1024
+
+
+def configure_one_shot_caches():
+    decoded_cache.configure(memory_bytes=0, disk_bytes=0)
+    stage_cache.configure(ONE_SHOT_STAGE_CACHE_BYTES)
+
+
+# === GUIDE DOT DETECTION ===
+# Guide dots used to be found with DBSCAN(eps=6, min_samples=3) over every
+# yellow pixel. The "components" engine labels the yellow mask (8-connected),
+# merges components whose pixels lie within DOT_EPS of each other and drops
+# groups smaller than DOT_MIN_SAMPLES. Solid dots give the same centres as
+# DBSCAN (both truncate the mean); results can only differ for sparse speckle
+# where DBSCAN's border-point rules would split a group.
+DOT_EPS = 6
+DOT_MIN_SAMPLES = 3
+DETECTION_ENGINES = ("components", "dbscan")
+DEFAULT_DETECTION_ENGINE = "components"
+
+
+def yellow_mask_from_pixels(pixels):
+    return (
+        ((pixels[:, :, 0] >= 200) & (pixels[:, :, 0] <= 255))
+        & ((pixels[:, :, 1] >= 180) & (pixels[:, :, 1] <= 240))
+        & (pixels[:, :, 2] < 50)
+    )
+
+
+def _merge_close_components(xs, ys, labels, count):
+    # Union components whose bounding boxes are within DOT_EPS and whose
+    # pixels really are; dots on a page are far apart so few pairs get checked.
+    order = np.argsort(labels, kind="stable")
+    sizes = np.bincount(labels, minlength=count)
+    splits = np.cumsum(sizes)[:-1]
+    coords = np.column_stack((xs[order], ys[order]))
+    pixel_sets = np.split(coords, splits)
+    boxes = [(c[:, 0].min(), c[:, 1].min(), c[:, 0].max(), c[:, 1].max()) for c in pixel_sets]
+
+    parent = list(range(count))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    by_top = sorted(range(count), key=lambda i: boxes[i][1])
+    trees = {}
+    for pos, i in enumerate(by_top):
+        x0, _, x1, y1 = boxes[i]
+        for j in by_top[pos + 1:]:
+            bx0, by0, bx1, _ = boxes[j]
+            if by0 - y1 > DOT_EPS:
+                break
+            if bx0 - x1 > DOT_EPS or x0 - bx1 > DOT_EPS or find(i) == find(j):
+                continue
+            for k in (i, j):
+                if k not in trees:
+                    trees[k] = cKDTree(pixel_sets[k])
+            if trees[i].count_neighbors(trees[j], DOT_EPS) > 0:
+                parent[find(j)] = find(i)
+
+    roots = np.array([find(i) for i in range(count)])
+    return roots[labels]
+
+
+def _dot_groups(mask):
+    # Pixel coordinates of the mask and the merged dot group each belongs to.
+    labeled, count = ndimage.label(mask, structure=np.ones((3, 3), dtype=bool))
+    if count == 0:
+        empty = np.zeros(0, dtype=np.intp)
+        return empty, empty, empty
+    ys, xs = np.nonzero(labeled)
+    labels = labeled[ys, xs] - 1
+    del labeled
+    return xs, ys, _merge_close_components(xs, ys, labels, count)
+
+
+def find_dot_centers_components(mask):
+    xs, ys, groups = _dot_groups(mask)
+    if len(groups) == 0:
+        return []
+    sizes = np.bincount(groups)
+    keep = sizes[groups] >= DOT_MIN_SAMPLES
+    return centers_from_labels(xs[keep], ys[keep], groups[keep])
+
+
+def find_dot_centers_dbscan(mask):
+    ys, xs = np.where(mask)
+    points = list(zip(xs, ys))
+
+    if not points:
+        return []
+    clustering = DBSCAN(eps=DOT_EPS, min_samples=DOT_MIN_SAMPLES).fit(points)
+    labels = clustering.labels_
+    clustered = labels >= 0
+    return centers_from_labels(xs[clustered], ys[clustered], labels[clustered])
+
+
+def centers_from_labels(xs, ys, labels):
+    # Mean position of each label in one pass instead of one scan per label.
+    if len(labels) == 0:
+        return []
+    sizes = np.bincount(labels)
+    sum_x = np.bincount(labels, weights=xs)
+    sum_y = np.bincount(labels, weights=ys)
+    present = np.nonzero(sizes)[0]
+    return [(int(sum_x[g] / sizes[g]), int(sum_y[g] / sizes[g])) for g in present]
+
+
+def find_dot_centers(mask, engine=DEFAULT_DETECTION_ENGINE):
+    if engine == "components":
+        return find_dot_centers_components(mask)
+    if engine == "dbscan":
+        return find_dot_centers_dbscan(mask)
+    raise ValueError(f"Unknown detection engine: {engine}")
+
+
+# Dots are spread over DOT_EPS and labeled 8-connected, so nothing further
+# than this many rows apart can belong to the same dot.
+_DOT_REACH = DOT_EPS + 1
+# Thread and pool sizes for the per-image stages below.
+DETECTION_WORKERS = os.cpu_count() or 1
+
+
+# === BAND-STREAMED DETECTION ===
+# Tall images are read in horizontal bands of DETECTION_BAND_HEIGHT rows, so
+# only one band's pixels and masks exist at a time. Bands only collect the
+# coordinates of yellow pixels, which are few; dots are formed from all of them
+# afterwards by dot_centers_from_pixels, so a dot cut by a band edge is grouped
+# across it and the centres equal the in-memory scan of the whole image.
+DETECTION_BAND_HEIGHT = 1024
+NO_DOT_PIXELS = (np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int32))
+
+
+def iter_detection_bands(image, band_height=DETECTION_BAND_HEIGHT, align=1):
+    # (top, band image) pairs; heights are kept a multiple of align so the
+    # coarse blocks of every band line up with those of the whole image.
+    band_height = max(align, int(band_height) // align * align)
+    if image.height <= band_height:
+        yield 0, image
+        return
+    for top in range(0, image.height, band_height):
+        yield top, image.crop((0, top, image.width, min(image.height, top + band_height)))
+
+
+def _pixel_arrays(xs, ys):
+    if not xs:
+        return NO_DOT_PIXELS
+    return np.concatenate(xs).astype(np.int32), np.concatenate(ys).astype(np.int32)
+
+
+def find_yellow_pixels(image, band_height=DETECTION_BAND_HEIGHT):
+    # (xs, ys) of every yellow pixel, testing every pixel one band at a time.
+    xs, ys = [], []
+    for top, band in iter_detection_bands(image, band_height):
+        band_ys, band_xs = np.nonzero(yellow_mask_from_pixels(np.asarray(band.convert("RGB"))))
+        xs.append(band_xs)
+        ys.append(band_ys + top)
+    return _pixel_arrays(xs, ys)
+
+
+def find_dot_centers_streaming(image, band_height=DETECTION_BAND_HEIGHT):
+    return dot_centers_from_pixels(*find_yellow_pixels(image, band_height))
+
+
+# === COARSE-TO-FINE DETECTION ===
+# Most of a line image has no yellow. The red and blue channels are box-reduced
+# by COARSE_FACTOR and blocks whose mean R - B is high enough to hold a yellow
+# pixel (R >= 200, B < 50 gives R - B >= 151) become candidates. The exact mask
+# is then evaluated only in row bands around candidates, padded so no dot can
+# reach across a band edge. Dot centres are identical to the full scan as long
+# as non-yellow content is neutral or warm (R >= B), as black ink is.
+COARSE_FACTOR = 4
+
+
+def _coarse_regions(image, factor):
+    red = np.asarray(image.getchannel("R").reduce(factor), dtype=np.int16)
+    blue = np.asarray(image.getchannel("B").reduce(factor), dtype=np.int16)
+    threshold = 151 // (factor * factor) - 1
+    candidates = (red - blue) >= threshold
+    candidate_rows = np.nonzero(candidates.any(axis=1))[0]
+    if len(candidate_rows) == 0:
+        return []
+
+    margin = -(-(_DOT_REACH + 1) // factor)
+    regions = []
+    run_start = run_end = candidate_rows[0]
+    for row in candidate_rows[1:]:
+        if row - run_end > 2 * margin:
+            regions.append((run_start, run_end))
+            run_start = row
+        run_end = row
+    regions.append((run_start, run_end))
+
+    boxes = []
+    for first, last in regions:
+        cols = np.nonzero(candidates[first:last + 1].any(axis=0))[0]
+        top = max(0, (first - margin) * factor)
+        bottom = min(image.height, (last + 1 + margin) * factor)
+        left = max(0, (cols[0] - margin) * factor)
+        right = min(image.width, (cols[-1] + 1 + margin) * factor)
+        boxes.append((left, top, right, bottom))
+    return boxes
+
+
+def find_dot_pixels(image, factor=COARSE_FACTOR, band_height=DETECTION_BAND_HEIGHT):
+    # (xs, ys) of every yellow pixel, reading the exact mask only in the
+    # coarse candidate regions of each detection band.
+    xs, ys = [], []
+    for band_top, band in iter_detection_bands(image, band_height, factor):
+        for left, top, right, bottom in _coarse_regions(band, factor):
+            region = np.asarray(band.crop((left, top, right, bottom)).convert("RGB"))
+            region_ys, region_xs = np.nonzero(yellow_mask_from_pixels(region))
+            xs.append(region_xs + left)
+            ys.append(region_ys + band_top + top)
+    return _pixel_arrays(xs, ys)
+
+
+def dot_centers_from_pixels(xs, ys):
+    # Groups yellow pixel coordinates exactly as find_dot_centers_components
+    # groups a mask holding them. Pixels more than DOT_EPS rows apart never
+    # share a dot, so the mask is only built for the row bands in between.
+    if len(ys) == 0:
+        return []
+    order = np.argsort(ys, kind="stable")
+    xs, ys = xs[order], ys[order]
+    breaks = np.nonzero(np.diff(ys) > DOT_EPS)[0] + 1
+    centers = []
+    for band_xs, band_ys in zip(np.split(xs, breaks), np.split(ys, breaks)):
+        left, top = int(band_xs.min()), int(band_ys[0])
+        mask = np.zeros((int(band_ys[-1]) - top + 1, int(band_xs.max()) - left + 1), dtype=bool)
+        mask[band_ys - top, band_xs - left] = True
+        centers.extend((x + left, y + top) for x, y in find_dot_centers_components(mask))
+    return centers
+
+
+def find_dot_centers_coarse(image, factor=COARSE_FACTOR, band_height=DETECTION_BAND_HEIGHT):
+    return dot_centers_from_pixels(*find_dot_pixels(image, factor, band_height))
+
+
+def detect_dot_centers(image, engine=DEFAULT_DETECTION_ENGINE, coarse=True, band_height=DETECTION_BAND_HEIGHT):
+    # Guide dots are yellow, so images without red and blue channels (L, 1,
+    # LA, ...) have none to find. The components engine streams the image in
+    # bands; DBSCAN needs the whole mask.
+    bands = image.getbands()
+    if "R" not in bands or "B" not in bands:
+        return []
+    if engine == "components":
+        if coarse:
+            return find_dot_centers_coarse(image, band_height=band_height)
+        return find_dot_centers_streaming(image, band_height)
+    pixels = np.asarray(image)
+    return find_dot_centers(yellow_mask_from_pixels(pixels), engine)
+
+
+def group_guide_rows(centers, y_tolerance):
+    # Sort dot centres by y and start a new row wherever the gap exceeds the
+    # tolerance; this is what 1-D DBSCAN(min_samples=1) did, in O(n log n).
+    # Rows with a single dot are dropped. Returns (line_y, min_x) per row.
+    if not centers:
+        return []
+    centers_array = np.asarray(centers)
+    order = np.argsort(centers_array[:, 1], kind="stable")
+    xs = centers_array[order, 0]
+    ys = centers_array[order, 1]
+    eps = max(1, int(abs(y_tolerance)))
+
+    starts = np.concatenate(([0], np.nonzero(np.diff(ys) > eps)[0] + 1))
+    ends = np.append(starts[1:], len(ys))
+    sizes = ends - starts
+    min_xs = np.minimum.reduceat(xs, starts)
+    medians = (ys[starts + (sizes - 1) // 2] + ys[starts + sizes // 2]) / 2
+
+    return [
+        (int(median), int(min_x))
+        for median, min_x, size in zip(medians, min_xs, sizes)
+        if size >= 2
+    ]
+
+
+# === CONNECTION FUNCTIONS ===
+def _fill_for_mode(mode, line_color):
+    return Image.new("RGB", (1, 1), tuple(line_color)).convert(mode).getpixel((0, 0))
+
+
+def draw_guide_lines(image, rows, line_thickness, line_color):
+    # Paints opaque guide lines straight into the image as filled row slices,
+    # covering the same pixels ImageDraw.line(width=line_thickness) would.
+    if line_thickness < 1:
+        return image
+    fill = _fill_for_mode(image.mode, line_color)
+    for line_y, min_x in rows:
+        x_start = max(0, min_x - line_thickness)
+        top = max(0, line_y - (line_thickness - 1) // 2)
+        bottom = min(image.height, line_y - (line_thickness - 1) // 2 + line_thickness)
+        if bottom > top and x_start < image.width:
+            image.paste(fill, (x_start, top, image.width, bottom))
+    return image
+
+
+def connect_guide_rows(image, centers, line_thickness, y_tolerance, line_color):
+    if not centers:
+        return image
+    # Draw a single horizontal guide per detected row
+    rows = group_guide_rows(centers, y_tolerance)
+    return draw_guide_lines(image, rows, line_thickness, line_color)
+
+
+def detect_and_connect_image(
+    image, line_thickness, y_tolerance, line_color, engine=DEFAULT_DETECTION_ENGINE, band_height=DETECTION_BAND_HEIGHT
+):
+    centers = detect_dot_centers(image, engine, band_height=band_height)
+    return connect_guide_rows(image, centers, line_thickness, y_tolerance, line_color)
+
+
+# === PER-SEGMENT DETECTION ===
+# The yellow pixels of each source image are found on their own (in a thread
+# pool; labeling and the mask arithmetic release the GIL) and kept in the stage
+# cache by content hash, so reordering the queue or replacing one line only
+# re-reads what changed. Later segments are pasted over earlier ones, so each
+# segment's pixels are clipped to the stitched rows it still shows before any
+# dot is formed: a partly covered dot keeps its visible pixels, DOT_MIN_SAMPLES
+# applies to what is left, and dots straddling a seam are grouped across it.
+# The centres equal a detection run on the stitched composite.
+#
+# Decoding and the coarse search hold the GIL for part of the time, so when
+# enough files are missing from the cache they are detected in worker
+# processes instead. Each worker decodes its files itself and sends back only
+# the yellow pixel coordinates, so no pixel data is pickled. Runs that keep
+# their decodes for later (remember, the preview) stay in threads, since a
+# worker's decode is lost to the parent.
+SEGMENT_DETECTION_WORKERS = DETECTION_WORKERS
+SEGMENT_DETECTION_PROCESSES = DETECTION_WORKERS
+PROCESS_DETECTION_MIN_SEGMENTS = 8
+
+
+def cached_segment_dots(path):
+    return stage_cache.get(("dot pixels", content_digest(path)))
+
+
+def store_segment_dots(path, dots):
+    return stage_cache.put(("dot pixels", content_digest(path)), dots, 64 + dots[0].nbytes + dots[1].nbytes)
+
+
+def detect_segment_dots(path, image=None, remember=False):
+    # image is the RGBA decode when the caller already has it.
+    dots = cached_segment_dots(path)
+    if dots is not None:
+        return dots
+    if image is None:
+        image = decoded_cache.get(path, "RGBA", remember)
+    return store_segment_dots(path, find_dot_pixels(image))
+
+
+def _detect_file_dots(path):
+    # Runs in a worker process; decodes as decoded_cache.get does but leaves
+    # the (forked) caches and their locks alone.
+    with Image.open(path) as source:
+        return find_dot_pixels(source.convert("RGBA"))
+
+
+def detect_files_in_processes(paths, processes=SEGMENT_DETECTION_PROCESSES):
+    # Dot pixels of each path, detected in up to processes worker processes.
+    with ProcessPoolExecutor(max_workers=max(1, min(processes, len(paths)))) as pool:
+        return [store_segment_dots(path, dots) for path, dots in zip(paths, pool.map(_detect_file_dots, paths))]
+
+
+def visible_dot_pixels(index, dots, segment_bounds):
+    # Stitched (xs, ys) of the segment's pixels that no later segment covers.
+    # Segment starts only grow, so only later segments starting above this
+    # one's end can cover any of it.
+    start, end = segment_bounds[index]
+    xs, ys = dots
+    ys = ys + start
+    visible = ys < end
+    for later_start, later_end in segment_bounds[index + 1:]:
+        if later_start >= end:
+            break
+        visible &= (ys < later_start) | (ys >= later_end)
+    return xs[visible], ys[visible]
+
+
+def _join_dot_pixels(pixel_sets):
+    pixel_sets = [pixels for pixels in pixel_sets if len(pixels[0])]
+    if not pixel_sets:
+        return NO_DOT_PIXELS
+    return (
+        np.concatenate([xs for xs, _ in pixel_sets]),
+        np.concatenate([ys for _, ys in pixel_sets]),
+    )
+
+
+def visible_segment_centers(segment_dots, segment_bounds):
+    return dot_centers_from_pixels(*_join_dot_pixels(
+        visible_dot_pixels(index, dots, segment_bounds) for index, dots in enumerate(segment_dots)
+    ))
+
+
+def settle_dot_pixels(xs, ys, frontier):
+    # Pixels still to come all lie at or below frontier. Returns the centres
+    # of the dots no such pixel can join, the pixels left open, and the top
+    # of those (frontier if none), below which no centre can still appear.
+    order = np.argsort(ys, kind="stable")
+    xs, ys = xs[order], ys[order]
+    first_open = int(np.searchsorted(ys, frontier - DOT_EPS))
+    if first_open == len(ys):
+        return dot_centers_from_pixels(xs, ys), NO_DOT_PIXELS, frontier
+    gaps = np.nonzero(np.diff(ys[:first_open + 1]) > DOT_EPS)[0]
+    cut = int(gaps[-1]) + 1 if len(gaps) else 0
+    open_top = min(frontier, int(ys[cut]))
+    return dot_centers_from_pixels(xs[:cut], ys[:cut]), (xs[cut:], ys[cut:]), open_top
+
+
+def detect_stitched_centers(
+    file_paths,
+    segment_bounds,
+    images=None,
+    workers=SEGMENT_DETECTION_WORKERS,
+    crop_boxes=None,
+    spacers=(),
+    remember=False,
+    processes=SEGMENT_DETECTION_PROCESSES,
+):
+    if images is None:
+        images = [None] * len(file_paths)
+    detected = {}
+    if processes > 1 and not remember:
+        missing = [
+            index
+            for index, path in enumerate(file_paths)
+            if index not in spacers and images[index] is None and cached_segment_dots(path) is None
+        ]
+        if len(missing) >= PROCESS_DETECTION_MIN_SEGMENTS:
+            found = detect_files_in_processes([file_paths[index] for index in missing], processes)
+            detected = dict(zip(missing, found))
+
+    def detect(index):
+        if index in spacers:
+            return NO_DOT_PIXELS
+        if index in detected:
+            return detected[index]
+        return detect_segment_dots(file_paths[index], images[index], remember)
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        segment_dots = list(pool.map(detect, range(len(file_paths))))
+    if crop_boxes is not None:
+        segment_dots = [crop_dot_pixels(dots, box) for dots, box in zip(segment_dots, crop_boxes)]
+    return visible_segment_centers(segment_dots, segment_bounds)
+
+
+# === RESIZE & STITCH ===
+def resize_to_match_width(images, target_width):
+    resized_images = []
+    for img in images:
+        if img.width == target_width:
+            resized_images.append(img)
+            continue
+        if img.mode == "L":
+            padded = Image.new("L", (target_width, img.height), 255)
+        else:
+            padded = Image.new("RGBA", (target_width, img.height), (255, 255, 255, 0))
+        padded.paste(img, (0, 0))
+        resized_images.append(padded)
+    return resized_images
+
+
+def compute_segment_bounds(heights, overlap_px=0):
+    overlap_value = int(overlap_px)
+    y_offset = 0
+    segment_bounds = []
+    for idx, height in enumerate(heights):
+        segment_start = y_offset
+        segment_end = segment_start + height
+        segment_bounds.append((segment_start, segment_end))
+        y_offset = segment_end
+        if idx < len(heights) - 1:
+            effective_overlap = overlap_value
+            if effective_overlap > 0:
+                effective_overlap = min(effective_overlap, height - 1)
+            y_offset -= effective_overlap
+            y_offset = max(0, y_offset)
+    return segment_bounds
+
+
+# === INK TRIMMING ===
+# Synthesised line images carry wide transparent or white margins. Trimming
+# crops each image to its ink (anything neither transparent nor near-white,
+# guide dots included) plus a padding, found from the row and column
+# projections of the ink mask. Rows are trimmed per image; the left edge is
+# shared by the whole queue so lines keep their indentation relative to each
+# other. Guide-dot pixels are shifted by the same crop offsets.
+TRIM_PADDING_PX = 10
+TRIM_WHITE_LEVEL = 245
+TRIM_WORKERS = DETECTION_WORKERS
+
+
+def ink_bounding_box(image, white_level=TRIM_WHITE_LEVEL):
+    # (left, top, right, bottom) of the ink in an RGBA or L image, or None.
+    pixels = np.asarray(image)
+    if pixels.ndim == 2:
+        ink = pixels < white_level
+    else:
+        ink = (pixels[:, :, 3] > 0) & (pixels[:, :, :3].min(axis=2) < white_level)
+    rows = np.flatnonzero(ink.any(axis=1))
+    if not len(rows):
+        return None
+    columns = np.flatnonzero(ink.any(axis=0))
+    return int(columns[0]), int(rows[0]), int(columns[-1]) + 1, int(rows[-1]) + 1
+
+
+def segment_ink_box(path, color_mode="RGBA", image=None, remember=False):
+    # Cached like detect_segment_dots; image is the decoded segment in
+    # color_mode when the caller already has it. Blank images give None.
+    key = ("ink box", content_digest(path), color_mode)
+    box = stage_cache.get(key, False)
+    if box is not False:
+        return box
+    if image is None:
+        image = load_segment(path, color_mode, remember=remember)[0]
+    return stage_cache.put(key, ink_bounding_box(image), 64)
+
+
+def trim_boxes(sizes, ink_boxes, padding=TRIM_PADDING_PX):
+    # Crop box per image; blank images keep their full height.
+    padding = max(0, int(padding))
+    lefts = [box[0] for box in ink_boxes if box is not None]
+    left = max(0, min(lefts) - padding) if lefts else 0
+    boxes = []
+    for (width, height), box in zip(sizes, ink_boxes):
+        crop_left = min(left, width - 1)
+        if box is None:
+            boxes.append((crop_left, 0, width, height))
+            continue
+        _, top, right, bottom = box
+        boxes.append((crop_left, max(0, top - padding), min(width, right + padding), min(height, bottom + padding)))
+    return boxes
+
+
+def crop_dot_pixels(dots, box):
+    if box is None or dots is None:
+        return dots
+    left, top, right, bottom = box
+    xs, ys = dots
+    inside = (xs >= left) & (xs < right) & (ys >= top) & (ys < bottom)
+    return xs[inside] - left, ys[inside] - top
+
+
+# === SPACER SEGMENTS ===
+# Paragraph spacer lines synthesise to blank images. They are recognised
+# without a full decode where possible: a PNG that compresses to more than
+# BLANK_MAX_COMPRESSED_FRACTION of its raw size has content; smaller files are
+# looked up by content hash in the stage cache's ink boxes, and only unknown
+# small files are decoded for an ink check. A spacer becomes a virtual gap of
+# its own height (or spacer_height) that is filled, never decoded, and
+# pagination prefers to break pages there.
+BLANK_MAX_COMPRESSED_FRACTION = 0.0025
+
+
+def segment_is_blank(path, color_mode="RGBA"):
+    with Image.open(path) as img:
+        raw_size = image_nbytes(img)
+    if os.path.getsize(path) > raw_size * BLANK_MAX_COMPRESSED_FRACTION:
+        return False
+    return segment_ink_box(path, color_mode) is None
+
+
+def load_segment(path, color_mode="RGBA", detect=False, remember=False):
+    # Decodes one line image in the pipeline mode through decoded_cache (so
+    # the result may be shared; remember keeps it in memory). Guide dots are
+    # read from the colour pixels, so a segment whose dots are not cached yet
+    # is decoded in RGBA first and converted from that.
+    dots = cached_segment_dots(path) if detect else None
+    decoded = None
+    if detect and dots is None:
+        decoded = decoded_cache.get(path, "RGBA", remember and color_mode == "RGBA")
+        dots = detect_segment_dots(path, decoded)
+        if color_mode == "RGBA":
+            return decoded, dots
+    return decoded_cache.get(path, color_mode, remember, decoded), dots
+
+
+# Line images are decoded in a thread pool (PNG inflate and mode conversion
+# release the GIL) and handed back in queue order. The pixels being decoded or
+# waiting to be handed back are capped at DECODE_MEMORY_LIMIT bytes, estimated
+# from the PNG headers, so a long queue cannot oversubscribe RAM.
+DECODE_WORKERS = DETECTION_WORKERS
+DECODE_MEMORY_LIMIT = 1024 * 1024 * 1024
+
+
+def _decode_cost(path):
+    with Image.open(path) as img:
+        width, height = img.size
+    # Decoded source plus its RGBA conversion.
+    return width * height * 8
+
+
+def iter_decoded_segments(
+    file_paths, color_mode="RGBA", detect=False, workers=DECODE_WORKERS, memory_limit=DECODE_MEMORY_LIMIT
+):
+    workers = max(1, workers)
+    pending = deque()
+    in_flight = 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for path in file_paths:
+            cost = _decode_cost(path)
+            while pending and (in_flight + cost > memory_limit or len(pending) >= 2 * workers):
+                future, done_cost = pending.popleft()
+                in_flight -= done_cost
+                yield future.result()
+            pending.append((pool.submit(load_segment, path, color_mode, detect), cost))
+            in_flight += cost
+        while pending:
+            future, _ = pending.popleft()
+            yield future.result()
+
+
+def stitch_images_from_paths(
+    file_paths,
+    connect=False,
+    overlap_px=0,
+    color_mode="RGBA",
+    trim_padding=None,
+    progress=None,
+    cancel_event=None,
+    line_settings=None,
+):
+    # line_settings is (thickness, tolerance, colour) and required to connect.
+    if not file_paths:
+        return None, "Warning: No images to stitch.", None
+    try:
+        if connect:
+            if line_settings is None:
+                return None, "Warning: Invalid line settings", None
+            thickness, tolerance, (r, g, b) = line_settings
+
+        spacers = {index for index, path in enumerate(file_paths) if segment_is_blank(path, color_mode)}
+        decoded = iter_decoded_segments(
+            [path for index, path in enumerate(file_paths) if index not in spacers], color_mode, connect
+        )
+        loaded = []
+        for index, path in enumerate(file_paths):
+            check_cancelled(cancel_event)
+            if index in spacers:
+                with Image.open(path) as img:
+                    loaded.append((blank_canvas(color_mode, img.size), NO_DOT_PIXELS if connect else None))
+            else:
+                loaded.append(next(decoded))
+            report_progress(progress, "Decoded", index + 1, len(file_paths))
+        if trim_padding is not None:
+            ink_boxes = [segment_ink_box(path, color_mode, img) for path, (img, _) in zip(file_paths, loaded)]
+            boxes = trim_boxes([img.size for img, _ in loaded], ink_boxes, trim_padding)
+            loaded = [(img.crop(box), crop_dot_pixels(dots, box)) for (img, dots), box in zip(loaded, boxes)]
+        images = [img for img, _ in loaded]
+        base_width = max(img.width for img in images)
+        resized_images = resize_to_match_width(images, base_width)
+
+        segment_bounds = compute_segment_bounds([img.height for img in resized_images], overlap_px)
+        total_height = max(1, max(end for _, end in segment_bounds))
+        stitched_img = blank_canvas(color_mode, (base_width, total_height))
+
+        for (segment_start, _), img in zip(segment_bounds, resized_images):
+            stitched_img.paste(img, (0, segment_start))
+
+        if connect:
+            centers = visible_segment_centers([dots for _, dots in loaded], segment_bounds)
+            stitched_img = connect_guide_rows(stitched_img, centers, thickness, tolerance, (r, g, b))
+
+        return stitched_img, None, segment_bounds
+
+    except OperationCancelled:
+        raise
+    except Exception as e:
+        return None, f"Error: {e}", None
+
+
+# === LAZY STITCH LAYOUT ===
+# Same geometry as stitch_images_from_paths, built from PNG headers only.
+# Regions of the stitched canvas are composed on demand from the source files,
+# so nothing larger than the requested rows is ever held in memory.
+# remember_decoded keeps the decoded lines in decoded_cache's memory tier, for
+# layouts that are rebuilt on every edit (the preview).
+class StitchLayout:
+    def __init__(
+        self, file_paths, overlap_px=0, color_mode="RGBA", trim_padding=None, spacer_height=None, remember_decoded=False
+    ):
+        if not file_paths:
+            raise ValueError("No images to stitch.")
+        self.file_paths = list(file_paths)
+        self.color_mode = color_mode
+        self.remember_decoded = remember_decoded
+        self.sizes = []
+        for path in self.file_paths:
+            with Image.open(path) as img:
+                self.sizes.append(img.size)
+        # With trimming, sizes and segment_bounds describe the cropped images;
+        # crop_boxes map them back to the source files.
+        self.crop_boxes = None
+        if trim_padding is not None:
+            with ThreadPoolExecutor(max_workers=max(1, TRIM_WORKERS)) as pool:
+                ink_boxes = list(pool.map(
+                    lambda path: segment_ink_box(path, color_mode, remember=remember_decoded), self.file_paths
+                ))
+            self.crop_boxes = trim_boxes(self.sizes, ink_boxes, trim_padding)
+            self.sizes = [(right - left, bottom - top) for left, top, right, bottom in self.crop_boxes]
+        self.spacers = {index for index, path in enumerate(self.file_paths) if segment_is_blank(path, color_mode)}
+        if spacer_height is not None:
+            for index in self.spacers:
+                self.sizes[index] = (self.sizes[index][0], max(1, int(spacer_height)))
+        self.width = max(width for width, _ in self.sizes)
+        self.segment_bounds = compute_segment_bounds([height for _, height in self.sizes], overlap_px)
+        self.height = max(1, max(end for _, end in self.segment_bounds))
+        # Content keys for the stage cache, hashed on first use so runs that
+        # never look anything up do not read every file an extra time.
+        self._segment_keys = {}
+        self.guide_rows = []
+        self.line_thickness = 0
+        self.line_color = (0, 0, 0)
+
+    def connect(self, line_thickness, y_tolerance, line_color):
+        centers = detect_stitched_centers(
+            self.file_paths,
+            self.segment_bounds,
+            crop_boxes=self.crop_boxes,
+            spacers=self.spacers,
+            remember=self.remember_decoded,
+        )
+        self.guide_rows = group_guide_rows(centers, y_tolerance)
+        self.line_thickness = line_thickness
+        self.line_color = line_color
+
+    def crop_box(self, index):
+        return self.crop_boxes[index] if self.crop_boxes is not None else None
+
+    def segment_key(self, index):
+        # What the segment shows: its file's content and crop, or a spacer size.
+        key = self._segment_keys.get(index)
+        if key is None:
+            if index in self.spacers:
+                key = ("spacer", self.sizes[index])
+            else:
+                key = (content_digest(self.file_paths[index]), self.crop_box(index))
+            self._segment_keys[index] = key
+        return key
+
+    def region_key(self, top, bottom, guide_rows=None):
+        # Everything compose(top, bottom) depends on: the segments showing in
+        # those rows, where they sit, and the guide lines reaching into them.
+        if guide_rows is None:
+            guide_rows = self.guide_rows
+        segments = tuple(
+            (self.segment_key(index), bounds)
+            for index, bounds in enumerate(self.segment_bounds)
+            if bounds[0] < bottom and bounds[1] > top
+        )
+        reach = self.line_thickness
+        rows = tuple(row for row in guide_rows if top - reach <= row[0] < bottom + reach)
+        line_style = (self.line_thickness, tuple(self.line_color)) if rows else None
+        return (self.color_mode, self.width, top, bottom, segments, rows, line_style)
+
+    def content_key(self):
+        segment_keys = tuple(self.segment_key(index) for index in range(len(self.file_paths)))
+        return (self.color_mode, self.width, segment_keys, tuple(self.segment_bounds))
+
+    def trim_segment(self, index, image, dots=None):
+        # Crops a decoded source image (and its dot pixels) to the segment.
+        box = self.crop_box(index)
+        if box is None:
+            return image, dots
+        return image.crop(box), crop_dot_pixels(dots, box)
+
+    def segment_image(self, index, images=None):
+        # Already decoded (and trimmed) images by segment index are used when given.
+        if images is not None and index in images:
+            return images[index]
+        if index in self.spacers:
+            return blank_canvas(self.color_mode, self.sizes[index])
+        image = load_segment(self.file_paths[index], self.color_mode, remember=self.remember_decoded)[0]
+        return self.trim_segment(index, image)[0]
+
+    def compose(self, top, bottom, images=None, guide_rows=None):
+        top = max(0, int(top))
+        bottom = min(self.height, int(bottom))
+        if guide_rows is None:
+            guide_rows = self.guide_rows
+        region = blank_canvas(self.color_mode, (self.width, max(1, bottom - top)))
+        for index, (start, end) in enumerate(self.segment_bounds):
+            if end <= top or start >= bottom:
+                continue
+            piece = self.segment_image(index, images)
+            if piece.width < self.width:
+                piece = resize_to_match_width([piece], self.width)[0]
+            piece = piece.crop((0, max(top, start) - start, self.width, min(bottom, end) - start))
+            region.paste(piece, (0, max(top, start) - top))
+        if guide_rows:
+            rows = [(line_y - top, min_x) for line_y, min_x in guide_rows]
+            draw_guide_lines(region, rows, self.line_thickness, self.line_color)
+        return region
+
+
+# === EXPORT PROFILES ===
+# "final" is the print setup; "draft" is for proof prints and review copies:
+# half the DPI, so a quarter of the pixels to resample and encode, bilinear
+# resampling, a lower JPEG quality and 4-bit grey PDF images. Pages and lines
+# are measured in cm and source pixels (see SOURCE_DPI), so both profiles lay
+# out the same pages. Outputs record the profile they were made with in their
+# metadata.
+EXPORT_PROFILES = {
+    "final": {"dpi": 300, "resample": "lanczos", "jpeg_quality": 75, "gray_bits": 8},
+    "draft": {"dpi": 150, "resample": "bilinear", "jpeg_quality": 60, "gray_bits": 4},
+}
+DEFAULT_EXPORT_PROFILE = "final"
+RESAMPLING_FILTERS = {"lanczos": Image.LANCZOS, "bilinear": Image.BILINEAR}
+EXPORT_SOFTWARE = "MyText Handwriting Image Toolkit"
+
+
+def export_profile(name=DEFAULT_EXPORT_PROFILE, dpi=None):
+    # The named profile's settings, with its DPI optionally overridden.
+    if name not in EXPORT_PROFILES:
+        raise ValueError(f"Unknown export profile: {name}")
+    settings = dict(EXPORT_PROFILES[name], name=name)
+    if dpi is not None:
+        settings["dpi"] = int(dpi)
+    settings["resample_filter"] = RESAMPLING_FILTERS[settings["resample"]]
+    return settings
+
+
+def profile_metadata(settings):
+    return {
+        "Software": EXPORT_SOFTWARE,
+        "Export profile": settings["name"],
+        "Resolution": f"{settings['dpi']} dpi",
+        "Resampling": settings["resample"],
+        "JPEG quality": str(settings["jpeg_quality"]),
+        "Grey depth": f"{settings['gray_bits']} bit",
+    }
+
+
+# === RESAMPLING ===
+# Scaling to the printable width is done band by band instead of as one huge
+# resize. A band covers output rows [out_start, out_end); the resize box maps
+# them onto exactly the source rows a whole-image resize would sample, so the
+# bands tile seamlessly. Pillow releases the GIL while resampling, so bands
+# run in a thread pool.
+RESAMPLE_WORKERS = DETECTION_WORKERS
+RESAMPLE_STRIP_HEIGHT = 512
+
+
+def resample_band(read_rows, width, height, out_start, out_end, target_width, new_height, resample=Image.LANCZOS):
+    # read_rows(top, bottom) returns the flattened source rows [top, bottom).
+    scale_factor = target_width / width
+    vertical_scale = new_height / height
+    source_top = out_start / vertical_scale
+    source_bottom = out_end / vertical_scale
+    pad = int(np.ceil(3 / scale_factor)) + 1
+    region_top = max(0, int(source_top) - pad)
+    region_bottom = min(height, int(np.ceil(source_bottom)) + pad)
+    region = read_rows(region_top, region_bottom)
+    return region.resize(
+        (target_width, out_end - out_start),
+        resample,
+        box=(0, source_top - region_top, width, source_bottom - region_top),
+    )
+
+
+def scale_rows_to_width(
+    image, row_ranges, target_width, new_height=None, workers=RESAMPLE_WORKERS, resample=Image.LANCZOS
+):
+    # Scales each (start, end) row range of image to target_width and returns
+    # [(scaled_image or None, (scaled_start, scaled_end)), ...] in input order.
+    width, height = image.size
+    scale_factor = target_width / width
+    if new_height is None:
+        new_height = int(round(height * scale_factor))
+
+    def read_rows(top, bottom):
+        return image.crop((0, top, width, bottom))
+
+    def scale_one(bounds):
+        start, end = bounds
+        out_start = min(new_height, int(round(start * scale_factor)))
+        out_end = min(new_height, int(round(end * scale_factor)))
+        if out_end <= out_start:
+            return None, (out_start, out_end)
+        band = resample_band(read_rows, width, height, out_start, out_end, target_width, new_height, resample)
+        return band, (out_start, out_end)
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        return list(pool.map(scale_one, row_ranges))
+
+
+def row_strips(height, strip_height=RESAMPLE_STRIP_HEIGHT):
+    return [(top, min(height, top + strip_height)) for top in range(0, height, strip_height)]
+
+
+def segment_row_strips(segment_bounds, scale_factor, content_height, strip_height=RESAMPLE_STRIP_HEIGHT):
+    # Output rows split where each segment starts, so every band scales the
+    # rows one segment shows on top; bands taller than strip_height are split.
+    edges = {0, content_height}
+    edges.update(min(content_height, int(round(start * scale_factor))) for start, _ in segment_bounds)
+    edges = sorted(edges)
+    return [
+        (top, min(bottom, top + strip_height))
+        for start, bottom in zip(edges, edges[1:])
+        for top in range(start, bottom, strip_height)
+    ]
+
+
+# === PDF EXPORT ===
+class PageOverflowError(ValueError):
+    # Content taller than the printable height of an A4 page.
+    pass
+
+
+def page_geometry(dpi=300):
+    a4_width_px = cm_to_px(21, dpi)
+    a4_height_px = cm_to_px(29.7, dpi)
+    margin_left = cm_to_px(0.4, dpi)
+    margin_right = cm_to_px(0.5, dpi)
+    margin_top = cm_to_px(2.0, dpi)
+    return {
+        "page_size": (a4_width_px, a4_height_px),
+        "margin_left": margin_left,
+        "margin_top": margin_top,
+        "printable_width": a4_width_px - margin_left - margin_right,
+        "printable_height": a4_height_px - margin_top,
+    }
+
+
+# Line images are SOURCE_DPI pixels: at that DPI they are placed unscaled
+# unless wider than the printable width, and other DPIs (the draft profile)
+# scale them along with the page, so every profile lays out the same pages.
+SOURCE_DPI = 300
+
+
+def content_scale(width, dpi=300):
+    return min(dpi / SOURCE_DPI, page_geometry(dpi)["printable_width"] / width)
+
+
+# A page that would overflow is cut after its last spacer instead, as long as
+# the page stays at least PAGE_BREAK_MIN_FILL full. Spacers are never the
+# first or last segment on a page.
+PAGE_BREAK_MIN_FILL = 0.6
+
+
+def paginate_segments(segments, content_height, printable_height, spacers=()):
+    # Each page is (page_start, page_end, [(start, end, segment_index), ...]).
+    normalized_segments = []
+    for index, (start, end) in enumerate(segments):
+        start = max(0, min(start, content_height))
+        end = max(0, min(end, content_height))
+        if end > start:
+            normalized_segments.append((start, end, index))
+
+    pages_meta = []
+    count = len(normalized_segments)
+    position = 0
+    while position < count:
+        while position < count and normalized_segments[position][2] in spacers:
+            position += 1
+        if position == count:
+            break
+        page_start, page_end, _ = normalized_segments[position]
+        if page_end - page_start > printable_height:
+            raise PageOverflowError("A source image exceeds the printable height of the page.")
+
+        next_position = position + 1
+        while next_position < count:
+            new_page_end = max(page_end, normalized_segments[next_position][1])
+            if new_page_end - page_start > printable_height:
+                break
+            page_end = new_page_end
+            next_position += 1
+
+        if next_position < count:
+            for candidate in range(next_position - 1, position, -1):
+                start, _, index = normalized_segments[candidate]
+                if index in spacers and start - page_start >= PAGE_BREAK_MIN_FILL * printable_height:
+                    next_position = candidate
+                    break
+
+        current_segments = normalized_segments[position:next_position]
+        while current_segments[-1][2] in spacers:
+            current_segments.pop()
+        page_end = max(end for _, end, _ in current_segments)
+        pages_meta.append((page_start, page_end, current_segments))
+        position = next_position
+    return pages_meta
+
+
+def iter_pdf_pages(image, segments, dpi=300, spacers=(), resample=Image.LANCZOS):
+    geometry = page_geometry(dpi)
+    margin_left = geometry["margin_left"]
+    margin_top = geometry["margin_top"]
+
+    img = flatten_transparency(image)
+    img_width, img_height = img.size
+
+    if not segments:
+        raise ValueError("No segment data available for pagination.")
+
+    scale_factor = content_scale(img_width, dpi)
+    if scale_factor < 1.0:
+        target_width = int(round(img_width * scale_factor))
+        scaled = scale_rows_to_width(img, segments, target_width, resample=resample)
+        content_height = int(round(img_height * target_width / img_width))
+    else:
+        scaled = [
+            (None, (int(round(start)), int(round(end))))
+            for start, end in segments
+        ]
+        content_height = img_height
+
+    pages_meta = paginate_segments(
+        [bounds for _, bounds in scaled], content_height, geometry["printable_height"], spacers
+    )
+
+    for page_start, _, segs in pages_meta:
+        canvas = Image.new(img.mode, geometry["page_size"], "white")
+        for start, end, index in segs:
+            segment = scaled[index][0]
+            if segment is None:
+                segment = img.crop((0, start, img_width, end))
+            offset_y = margin_top + (start - page_start)
+            canvas.paste(segment, (margin_left, int(offset_y)))
+        yield canvas
+
+
+def generate_pdf_pages(image, segments, dpi=300, spacers=(), resample=Image.LANCZOS):
+    return list(iter_pdf_pages(image, segments, dpi, spacers, resample))
+
+
+def layout_pagination(layout, dpi=300):
+    # Returns (geometry, scale_factor, content_height, pages_meta) for a layout.
+    geometry = page_geometry(dpi)
+    scale_factor = content_scale(layout.width, dpi)
+    content_height = int(round(layout.height * scale_factor))
+    segments = [
+        (int(round(start * scale_factor)), int(round(end * scale_factor)))
+        for start, end in layout.segment_bounds
+    ]
+    pages_meta = paginate_segments(segments, content_height, geometry["printable_height"], layout.spacers)
+    return geometry, scale_factor, content_height, pages_meta
+
+
+def page_source_window(layout, page_start, page_end, scale_factor, content_height):
+    # Source rows a page reads, including the resampling filter's support.
+    if scale_factor == 1.0:
+        return page_start, page_end
+    vertical_scale = content_height / layout.height
+    pad = int(np.ceil(3 / scale_factor)) + 1
+    top = max(0, int(page_start / vertical_scale) - pad)
+    bottom = min(layout.height, int(np.ceil(page_end / vertical_scale)) + pad)
+    return top, bottom
+
+
+def scaled_layout_rows(
+    layout,
+    out_start,
+    out_end,
+    target_width,
+    scale_factor,
+    content_height,
+    images=None,
+    guide_rows=None,
+    resample=Image.LANCZOS,
+):
+    # Rows [out_start, out_end) of the flattened document scaled to
+    # target_width, through the stage cache. Cached bands are shared.
+    top, bottom = page_source_window(layout, out_start, out_end, scale_factor, content_height)
+    key = (
+        "scaled", layout.region_key(top, bottom, guide_rows), out_start, out_end, target_width, content_height, resample
+    )
+    band = stage_cache.get(key)
+    if band is not None:
+        return band
+
+    def read_rows(top, bottom):
+        return flatten_transparency(layout.compose(top, bottom, images, guide_rows))
+
+    if scale_factor == 1.0:
+        band = read_rows(out_start, out_end)
+    else:
+        band = resample_band(
+            read_rows, layout.width, layout.height, out_start, out_end, target_width, content_height, resample
+        )
+    return stage_cache.put(key, band, image_nbytes(band))
+
+
+def render_layout_page(
+    layout,
+    page_start,
+    page_end,
+    geometry,
+    scale_factor,
+    content_height,
+    images=None,
+    guide_rows=None,
+    resample=Image.LANCZOS,
+):
+    page_img = scaled_layout_rows(
+        layout,
+        page_start,
+        page_end,
+        int(round(layout.width * scale_factor)),
+        scale_factor,
+        content_height,
+        images,
+        guide_rows,
+        resample,
+    )
+    canvas = Image.new(page_img.mode, geometry["page_size"], "white")
+    canvas.paste(page_img, (geometry["margin_left"], geometry["margin_top"]))
+    return canvas
+
+
+def iter_layout_pages(layout, dpi=300, resample=Image.LANCZOS):
+    # Pages in the same geometry as generate_pdf_pages, but each page is
+    # composed from the source files and resampled on its own. The resize box
+    # maps output rows to the same source rows the whole-image resize used.
+    geometry, scale_factor, content_height, pages_meta = layout_pagination(layout, dpi)
+    for page_start, page_end, _ in pages_meta:
+        yield render_layout_page(
+            layout, page_start, page_end, geometry, scale_factor, content_height, resample=resample
+        )
+
+
+# === FINAL FORMATTING ===
+def prepare_printable_a4(image, original_path, dpi=300, resample=Image.LANCZOS, output_path=None):
+    # Lays a whole stitched image onto one A4 page and saves it, by default
+    # next to original_path as "<name>_formatted.png". Returns the saved path.
+    geometry = page_geometry(dpi)
+    a4_width_px, a4_height_px = geometry["page_size"]
+    margin_left = geometry["margin_left"]
+    margin_top = geometry["margin_top"]
+
+    img = flatten_transparency(image)
+    img_width, img_height = img.size
+
+    scaled_height = None
+    scale_factor = content_scale(img_width, dpi)
+    if scale_factor < 1.0:
+        scaled_height = int(img_height * scale_factor)
+        img_height = scaled_height
+
+    if img_height > geometry["printable_height"]:
+        raise PageOverflowError("Image too tall for A4 page with margins.")
+
+    canvas = Image.new(img.mode, (a4_width_px, a4_height_px), "white")
+    if scaled_height is None:
+        canvas.paste(img, (margin_left, margin_top))
+    else:
+        target_width = int(round(img_width * scale_factor))
+        strips = scale_rows_to_width(
+            img, row_strips(img.height), target_width, new_height=scaled_height, resample=resample
+        )
+        for strip, (start, _) in strips:
+            if strip is not None:
+                canvas.paste(strip, (margin_left, margin_top + start))
+
+    if output_path is None:
+        output_path = os.path.splitext(original_path)[0] + "_formatted.png"
+    canvas.save(output_path, dpi=(dpi, dpi))
+    return output_path
+
+
+# === STREAMING PDF WRITER ===
+# Writes one page at a time: each page's image, content stream and page object
+# are encoded and flushed as soon as the page is added, and the page tree,
+# catalog and xref table follow on close. Output goes to a temporary file that
+# only replaces the target once the document is complete.
+#
+# Colour modes: "rgb" keeps the JPEG-encoded colour pages; "gray" writes 8-bit
+# (or, with gray_bits=4, 4-bit) grayscale with Flate; "bilevel" thresholds to 1 bit and uses CCITT G4 (Flate
+# when Pillow has no libtiff). Ink and guide lines are black on white, so the
+# smaller modes lose nothing visible.
+#
+# With downsample set to a resampling filter, an image placed smaller than its
+# pixels is resized to its placed size before encoding; draft exports use this
+# to embed lines at the export DPI instead of the source resolution. Metadata
+# is written as the document information dictionary.
+PDF_COLOR_MODES = ("rgb", "gray", "bilevel")
+GRAY_BITS = (4, 8)
+DEFAULT_BILEVEL_THRESHOLD = 128
+
+
+def binarize(image, threshold=DEFAULT_BILEVEL_THRESHOLD):
+    return image.convert("L").point(lambda value: 255 if value >= threshold else 0, mode="1")
+
+
+def _pack_gray4(image):
+    # 4-bit grey samples, two per byte, each row padded to a whole byte.
+    pixels = (np.asarray(image.convert("L"), dtype=np.uint16) * 15 + 127) // 255
+    if pixels.shape[1] % 2:
+        pixels = np.pad(pixels, ((0, 0), (0, 1)))
+    return ((pixels[:, 0::2] << 4) | pixels[:, 1::2]).astype(np.uint8).tobytes()
+
+
+def _encode_group4(image):
+    # Pillow only writes G4 inside a TIFF; keep the single strip's raw bytes.
+    buffer = io.BytesIO()
+    image.save(buffer, "TIFF", compression="group4", strip_size=-(-image.width // 8) * image.height)
+    buffer.seek(0)
+    with Image.open(buffer) as tiff:
+        offsets = tiff.tag_v2[273]
+        counts = tiff.tag_v2[279]
+    if len(offsets) != 1:
+        raise ValueError("Expected a single G4 strip.")
+    data = buffer.getvalue()
+    return data[offsets[0]:offsets[0] + counts[0]]
+
+
+def _pdf_name(key):
+    # Standard keys ("Producer") pass through; others become "Export_profile".
+    return "_".join(str(key).split()).encode("ascii", "replace")
+
+
+def _pdf_text(value):
+    text = str(value).encode("latin-1", "replace")
+    return b"(" + text.replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(b")", b"\\)") + b")"
+
+
+class PdfPageWriter:
+    def __init__(
+        self,
+        path,
+        resolution=300.0,
+        jpeg_quality=75,
+        color_mode="rgb",
+        bilevel_threshold=DEFAULT_BILEVEL_THRESHOLD,
+        flate_level=6,
+        downsample=None,
+        metadata=None,
+        gray_bits=8,
+    ):
+        if color_mode not in PDF_COLOR_MODES:
+            raise ValueError(f"Unknown PDF colour mode: {color_mode}")
+        if gray_bits not in GRAY_BITS:
+            raise ValueError(f"Unsupported grey depth: {gray_bits}")
+        self.path = path
+        self.resolution = float(resolution)
+        self.jpeg_quality = jpeg_quality
+        self.color_mode = color_mode
+        self.bilevel_threshold = bilevel_threshold
+        self.flate_level = flate_level
+        self.downsample = downsample
+        self.gray_bits = gray_bits
+        self.metadata = dict(metadata or {})
+        self.page_count = 0
+        self._finished = False
+        self._temp_path = path + ".part"
+        self._file = open(self._temp_path, "wb")
+        self._offsets = {}
+        self._page_ids = []
+        self._next_id = 3  # 1 is the catalog, 2 the page tree
+        self._file.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+
+    def _reserve_id(self):
+        object_id = self._next_id
+        self._next_id += 1
+        return object_id
+
+    def _write_object(self, object_id, body, stream=None):
+        self._offsets[object_id] = self._file.tell()
+        self._file.write(b"%d 0 obj\n" % object_id)
+        self._file.write(body)
+        if stream is not None:
+            self._file.write(b"\nstream\n")
+            self._file.write(stream)
+            self._file.write(b"\nendstream")
+        self._file.write(b"\nendobj\n")
+
+    def _encode_image(self, image):
+        # Returns (data, image dictionary entries) for the page's XObject.
+        width, height = image.size
+        if self.color_mode == "bilevel":
+            image = binarize(image, self.bilevel_threshold)
+            if features.check("libtiff"):
+                params = b"<< /K -1 /BlackIs1 true /Columns %d /Rows %d >>" % (width, height)
+                entries = b"/ColorSpace /DeviceGray /BitsPerComponent 1 /Filter /CCITTFaxDecode /DecodeParms %s" % params
+                return _encode_group4(image), entries
+            entries = b"/ColorSpace /DeviceGray /BitsPerComponent 1 /Filter /FlateDecode"
+            return zlib.compress(image.tobytes(), self.flate_level), entries
+        if self.color_mode == "gray":
+            entries = b"/ColorSpace /DeviceGray /BitsPerComponent %d /Filter /FlateDecode" % self.gray_bits
+            data = _pack_gray4(image) if self.gray_bits == 4 else image.convert("L").tobytes()
+            return zlib.compress(data, self.flate_level), entries
+
+        if image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        buffer = io.BytesIO()
+        image.save(buffer, "JPEG", quality=self.jpeg_quality)
+        colorspace = b"/DeviceRGB" if image.mode == "RGB" else b"/DeviceGray"
+        return buffer.getvalue(), b"/ColorSpace %s /BitsPerComponent 8 /Filter /DCTDecode" % colorspace
+
+    def encoding_key(self):
+        return (
+            self.color_mode, self.bilevel_threshold, self.jpeg_quality, self.flate_level, self.downsample, self.gray_bits
+        )
+
+    def encode_image(self, image, scale=1.0):
+        # scale is the placed size over the pixel size; it only matters with
+        # downsample set.
+        if self.downsample is not None and scale < 1.0:
+            size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+            image = image.resize(size, self.downsample, reducing_gap=1.0)
+        data, entries = self._encode_image(image)
+        return data, entries, image.size
+
+    def add_encoded_image(self, encoded):
+        # Writes an image XObject and returns its object id for placements.
+        data, entries, (width, height) = encoded
+        image_id = self._reserve_id()
+        self._write_object(
+            image_id,
+            b"<< /Type /XObject /Subtype /Image /Width %d /Height %d %s /Length %d >>"
+            % (width, height, entries, len(data)),
+            data,
+        )
+        return image_id
+
+    def add_image(self, image):
+        return self.add_encoded_image(self.encode_image(image))
+
+    def add_placed_page(self, page_size, placements, extra_content=b""):
+        # page_size and placements (image_id, left, top, width, height) are in
+        # pixels at the writer's resolution, measured from the top-left corner.
+        # A placement without an image id paints its rectangle white.
+        to_pt = 72.0 / self.resolution
+        width_pt = page_size[0] * to_pt
+        height_pt = page_size[1] * to_pt
+        operations = []
+        for image_id, left, top, width, height in placements:
+            box = (left * to_pt, height_pt - (top + height) * to_pt, width * to_pt, height * to_pt)
+            if image_id is None:
+                operations.append(b"q 1 g %.4f %.4f %.4f %.4f re f Q" % box)
+                continue
+            operations.append(
+                b"q %.4f 0 0 %.4f %.4f %.4f cm /Im%d Do Q" % (box[2], box[3], box[0], box[1], image_id)
+            )
+        content = b"\n".join(operations)
+        if extra_content:
+            content += b"\n" + extra_content
+        content_id = self._reserve_id()
+        self._write_object(content_id, b"<< /Length %d >>" % len(content), content)
+
+        xobjects = b" ".join(
+            b"/Im%d %d 0 R" % (image_id, image_id) for image_id, *_ in placements if image_id is not None
+        )
+        page_id = self._reserve_id()
+        self._write_object(
+            page_id,
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %.4f %.4f]"
+            b" /Resources << /XObject << %s >> >> /Contents %d 0 R >>"
+            % (width_pt, height_pt, xobjects, content_id),
+        )
+        self._page_ids.append(page_id)
+        self.page_count += 1
+        self._file.flush()
+
+    def add_page(self, image):
+        image_id = self.add_image(image)
+        self.add_placed_page(image.size, [(image_id, 0, 0, image.width, image.height)])
+
+    def close(self):
+        if self._finished:
+            return
+        self._finished = True
+        kids = b" ".join(b"%d 0 R" % page_id for page_id in self._page_ids)
+        self._write_object(2, b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(self._page_ids)))
+        self._write_object(1, b"<< /Type /Catalog /Pages 2 0 R >>")
+        info = b""
+        if self.metadata:
+            info_id = self._reserve_id()
+            self._write_object(
+                info_id,
+                b"<< %s >>"
+                % b" ".join(
+                    b"/%s %s" % (_pdf_name(key), _pdf_text(value)) for key, value in self.metadata.items()
+                ),
+            )
+            info = b" /Info %d 0 R" % info_id
+
+        xref_offset = self._file.tell()
+        self._file.write(b"xref\n0 %d\n0000000000 65535 f \n" % self._next_id)
+        for object_id in range(1, self._next_id):
+            self._file.write(b"%010d 00000 n \n" % self._offsets[object_id])
+        self._file.write(
+            b"trailer\n<< /Size %d /Root 1 0 R%s >>\nstartxref\n%d\n%%%%EOF\n"
+            % (self._next_id, info, xref_offset)
+        )
+        self._file.close()
+        os.replace(self._temp_path, self.path)
+
+    def abort(self):
+        if self._finished:
+            return
+        self._finished = True
+        self._file.close()
+        try:
+            os.remove(self._temp_path)
+        except OSError:
+            pass
+
+
+def write_pdf(
+    pages,
+    save_path,
+    resolution=300.0,
+    color_mode="rgb",
+    bilevel_threshold=DEFAULT_BILEVEL_THRESHOLD,
+    jpeg_quality=75,
+    flate_level=6,
+    metadata=None,
+):
+    # Returns the number of pages written; nothing is left on disk for zero.
+    with PdfPageWriter(
+        save_path,
+        resolution=resolution,
+        jpeg_quality=jpeg_quality,
+        color_mode=color_mode,
+        bilevel_threshold=bilevel_threshold,
+        flate_level=flate_level,
+        metadata=metadata,
+    ) as writer:
+        for page in pages:
+            writer.add_page(page)
+        if writer.page_count == 0:
+            writer.abort()
+            return 0
+    return writer.page_count
+
+
+# === DIRECT PDF COMPOSITION ===
+# Instead of rasterising A4 pages, each source line is flattened once, embedded
+# as an image XObject at its native resolution and placed on its page with a
+# transform at the paginated offset and left margin. White margins are never
+# encoded and no resampling happens on export. A line whose overlap continues
+# onto the next page shows its own pixels there rather than the start of the
+# following line.
+#
+# With vector guides the images stay untouched and each guide row becomes a
+# filled rectangle in the page content stream, so a new thickness or colour
+# only re-emits content streams; encoded images are reused from the stage
+# cache.
+
+
+def _segment_with_guides(layout, index, images=None, guide_rows=None):
+    start, end = layout.segment_bounds[index]
+    segment = layout.segment_image(index, images)
+    if guide_rows is None:
+        guide_rows = layout.guide_rows
+    reach = layout.line_thickness
+    rows = [
+        (line_y - start, min_x)
+        for line_y, min_x in guide_rows
+        if start - reach <= line_y < end + reach
+    ]
+    if rows:
+        # Guides run to the right edge of the stitched canvas; decoded images
+        # may be shared with the stage cache, so draw on a copy.
+        if segment.width == layout.width:
+            segment = segment.copy()
+        else:
+            segment = resize_to_match_width([segment], layout.width)[0]
+        draw_guide_lines(segment, rows, layout.line_thickness, layout.line_color)
+    return flatten_transparency(segment)
+
+
+def _encoded_plain_segment(writer, path, color_mode="RGBA", image=None, crop_box=None, scale=1.0):
+    key = ("encoded segment", content_digest(path), color_mode, crop_box, scale) + writer.encoding_key()
+    encoded = stage_cache.get(key)
+    if encoded is not None:
+        return encoded
+    if image is None:
+        image = load_segment(path, color_mode)[0]
+        if crop_box is not None:
+            image = image.crop(crop_box)
+    encoded = writer.encode_image(flatten_transparency(image), scale)
+    return stage_cache.put(key, encoded, len(encoded[0]))
+
+
+def _guide_fill_operator(line_color, color_mode, bilevel_threshold):
+    r, g, b = line_color
+    if color_mode == "rgb":
+        return b"%.4f %.4f %.4f rg" % (r / 255, g / 255, b / 255)
+    gray = Image.new("RGB", (1, 1), (r, g, b)).convert("L").getpixel((0, 0))
+    if color_mode == "bilevel":
+        gray = 255 if gray >= bilevel_threshold else 0
+    return b"%.4f g" % (gray / 255)
+
+
+def guide_content(layout, page_start, page_end, scale_factor, geometry, fill_operator, to_pt, guide_rows=None):
+    # Guide rows as PDF rectangles, clipped to the page's content rows, using
+    # the same pixel span draw_guide_lines covers.
+    page_height_pt = geometry["page_size"][1] * to_pt
+    thickness = layout.line_thickness
+    if guide_rows is None:
+        guide_rows = layout.guide_rows
+    operations = []
+    for line_y, min_x in guide_rows:
+        top = (line_y - (thickness - 1) // 2) * scale_factor
+        bottom = top + thickness * scale_factor
+        top = max(top, page_start)
+        bottom = min(bottom, page_end)
+        if bottom <= top:
+            continue
+        left = max(0, min_x - thickness) * scale_factor
+        right = layout.width * scale_factor
+        page_top = geometry["margin_top"] + top - page_start
+        operations.append(
+            b"%.4f %.4f %.4f %.4f re f"
+            % (
+                (geometry["margin_left"] + left) * to_pt,
+                page_height_pt - (page_top + bottom - top) * to_pt,
+                (right - left) * to_pt,
+                (bottom - top) * to_pt,
+            )
+        )
+    if not operations:
+        return b""
+    return b"q " + fill_operator + b"\n" + b"\n".join(operations) + b"\nQ"
+
+
+def page_window(layout, page, scale_factor, content_height):
+    # Source rows a paginated page draws from, for both raster and direct pages.
+    page_start, page_end, segs = page
+    top, bottom = page_source_window(layout, page_start, page_end, scale_factor, content_height)
+    seg_bounds = [layout.segment_bounds[index] for _, _, index in segs]
+    return min([top] + [start for start, _ in seg_bounds]), max([bottom] + [end for _, end in seg_bounds])
+
+
+def direct_page_parts(
+    layout, writer, page, geometry, scale_factor, vector_guides=True, images=None, guide_rows=None
+):
+    # Encodes one page's segment images and returns (encoded images, with
+    # None for white fills, placements without ids, extra content stream).
+    if guide_rows is None:
+        guide_rows = layout.guide_rows
+    content_height = int(round(layout.height * scale_factor))
+    top, bottom = page_window(layout, page, scale_factor, content_height)
+    key = (
+        "pdf page",
+        layout.region_key(top, bottom, guide_rows),
+        tuple(page[2]),
+        page[0],
+        page[1],
+        scale_factor,
+        tuple(sorted(geometry.items())),
+        vector_guides,
+        writer.resolution,
+    ) + writer.encoding_key()
+    parts = stage_cache.get(key)
+    if parts is None:
+        parts = _direct_page_parts(layout, writer, page, geometry, scale_factor, vector_guides, images, guide_rows)
+        encoded_bytes = sum(len(encoded[0]) for encoded in parts[0] if encoded is not None)
+        stage_cache.put(key, parts, encoded_bytes + len(parts[2]) + 256)
+    return parts
+
+
+def _direct_page_parts(layout, writer, page, geometry, scale_factor, vector_guides, images, guide_rows):
+    page_start, page_end, segs = page
+    draw_vectors = vector_guides and guide_rows and layout.line_thickness > 0
+    encoded_images = []
+    placements = []
+    drawn_bottom = None
+    for start, end, index in segs:
+        top = geometry["margin_top"] + start - page_start
+        if index in layout.spacers and (draw_vectors or not guide_rows):
+            encoded, width_px = None, 0
+        elif draw_vectors or not guide_rows:
+            image = images.get(index) if images is not None else None
+            encoded = _encoded_plain_segment(
+                writer, layout.file_paths[index], layout.color_mode, image, layout.crop_box(index), scale_factor
+            )
+            width_px = layout.sizes[index][0]
+        else:
+            segment = _segment_with_guides(layout, index, images, guide_rows)
+            encoded = writer.encode_image(segment, scale_factor)
+            width_px = segment.width
+        # In the stitched canvas every line covers the full width, so paint
+        # white where this one is narrower than an earlier line reaching into it.
+        if drawn_bottom is not None and drawn_bottom > top and width_px < layout.width:
+            encoded_images.append(None)
+            placements.append((
+                geometry["margin_left"] + width_px * scale_factor,
+                top,
+                (layout.width - width_px) * scale_factor,
+                min(end - start, drawn_bottom - top),
+            ))
+        if encoded is None:
+            continue
+        encoded_images.append(encoded)
+        placements.append((geometry["margin_left"], top, width_px * scale_factor, end - start))
+        drawn_bottom = max(drawn_bottom or top, top + end - start)
+    extra_content = b""
+    if draw_vectors:
+        fill_operator = _guide_fill_operator(layout.line_color, writer.color_mode, writer.bilevel_threshold)
+        extra_content = guide_content(
+            layout, page_start, page_end, scale_factor, geometry, fill_operator, 72.0 / writer.resolution, guide_rows
+        )
+    return encoded_images, placements, extra_content
+
+
+def add_direct_page(writer, geometry, parts):
+    encoded_images, placements, extra_content = parts
+    image_ids = [None if encoded is None else writer.add_encoded_image(encoded) for encoded in encoded_images]
+    writer.add_placed_page(
+        geometry["page_size"],
+        [(image_id,) + placement for image_id, placement in zip(image_ids, placements)],
+        extra_content,
+    )
+
+
+def profile_pdf_writer(save_path, settings, color_mode="rgb", bilevel_threshold=DEFAULT_BILEVEL_THRESHOLD):
+    # Draft profiles embed lines at the export DPI; the final profile keeps
+    # the source pixels.
+    return PdfPageWriter(
+        save_path,
+        resolution=float(settings["dpi"]),
+        jpeg_quality=settings["jpeg_quality"],
+        color_mode=color_mode,
+        bilevel_threshold=bilevel_threshold,
+        downsample=None if settings["name"] == "final" else settings["resample_filter"],
+        metadata=dict(profile_metadata(settings), Producer=EXPORT_SOFTWARE),
+        gray_bits=settings["gray_bits"],
+    )
+
+
+def write_layout_pdf(
+    layout,
+    save_path,
+    dpi=None,
+    color_mode="rgb",
+    bilevel_threshold=DEFAULT_BILEVEL_THRESHOLD,
+    vector_guides=True,
+    profile=DEFAULT_EXPORT_PROFILE,
+):
+    settings = export_profile(profile, dpi)
+    geometry, scale_factor, _, pages_meta = layout_pagination(layout, settings["dpi"])
+    with profile_pdf_writer(save_path, settings, color_mode, bilevel_threshold) as writer:
+        for page in pages_meta:
+            parts = direct_page_parts(layout, writer, page, geometry, scale_factor, vector_guides)
+            add_direct_page(writer, geometry, parts)
+        if writer.page_count == 0:
+            writer.abort()
+            return 0
+    return writer.page_count
+
+
+# === PREVIEW ===
+# Low-DPI pages for the preview pane. Pagination is the export's own
+# (layout_pagination at the export DPI) and each page shows the segments the
+# direct PDF places there, drawn from thumbnails made once per segment with
+# Image.reduce and kept in the stage cache. Guide lines are scaled boxes, so a
+# new thickness, tolerance, overlap or order only re-runs the cheap layout
+# math and pastes. Edits are debounced for PREVIEW_DEBOUNCE_MS, short enough
+# that a finished keystroke shows within about a tenth of a second.
+PREVIEW_DPI = 36
+PREVIEW_DEBOUNCE_MS = 70
+
+
+def segment_thumbnail(layout, index, factor):
+    key = ("thumbnail", layout.segment_key(index), layout.color_mode, factor)
+    thumbnail = stage_cache.get(key)
+    if thumbnail is None:
+        image = layout.segment_image(index)
+        thumbnail = image.reduce(factor) if factor > 1 else image
+        thumbnail = stage_cache.put(key, thumbnail, image_nbytes(thumbnail))
+    return thumbnail
+
+
+def render_preview_pages(layout, preview_dpi=PREVIEW_DPI, dpi=300):
+    geometry, scale_factor, _, pages_meta = layout_pagination(layout, dpi)
+    preview_scale = preview_dpi / dpi
+    to_preview = scale_factor * preview_scale
+    page_width, page_height = geometry["page_size"]
+    page_size = (max(1, round(page_width * preview_scale)), max(1, round(page_height * preview_scale)))
+    content_width = max(1, round(layout.width * to_preview))
+    factor = max(1, int(1 / to_preview))
+    thickness = max(1, round(layout.line_thickness * to_preview)) if layout.line_thickness > 0 else 0
+
+    pages = []
+    for page_start, page_end, segs in pages_meta:
+        region = blank_canvas(layout.color_mode, (content_width, max(1, round((page_end - page_start) * preview_scale))))
+        for start, end, index in segs:
+            if index in layout.spacers:
+                continue
+            size = (max(1, round(layout.sizes[index][0] * to_preview)), max(1, round((end - start) * preview_scale)))
+            thumbnail = segment_thumbnail(layout, index, factor).resize(size, Image.BILINEAR)
+            region.paste(thumbnail, (0, round((start - page_start) * preview_scale)))
+        if thickness:
+            reach = layout.line_thickness * scale_factor
+            rows = [
+                (round((line_y * scale_factor - page_start) * preview_scale), round(min_x * to_preview))
+                for line_y, min_x in layout.guide_rows
+                if page_start - reach <= line_y * scale_factor < page_end + reach
+            ]
+            draw_guide_lines(region, rows, thickness, layout.line_color)
+        page = Image.new("L" if layout.color_mode == "L" else "RGB", page_size, "white")
+        page.paste(
+            flatten_transparency(region),
+            (round(geometry["margin_left"] * preview_scale), round(geometry["margin_top"] * preview_scale)),
+        )
+        pages.append(page)
+    return pages
+
+
+# === STREAMING PNG WRITER ===
+# The A4 PNG counterpart of PdfPageWriter: rows are filtered and deflated in
+# strips, in order, so a page can be encoded while later strips are still
+# being composed. Output goes to a temporary file like the PDF writer.
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+class PngStripWriter:
+    def __init__(self, path, size, mode="RGB", dpi=300, compress_level=6, metadata=None):
+        if mode not in ("RGB", "L"):
+            raise ValueError(f"Unsupported PNG mode: {mode}")
+        self.path = path
+        self.size = size
+        self.mode = mode
+        self.rows_written = 0
+        self._channels = 3 if mode == "RGB" else 1
+        self._compressor = zlib.compressobj(compress_level)
+        self._finished = False
+        self._temp_path = path + ".part"
+        self._file = open(self._temp_path, "wb")
+        width, height = size
+        color_type = 2 if mode == "RGB" else 0
+        pixels_per_metre = int(round(dpi / 0.0254))
+        self._file.write(PNG_SIGNATURE)
+        self._write_chunk(b"IHDR", width.to_bytes(4, "big") + height.to_bytes(4, "big") + bytes((8, color_type, 0, 0, 0)))
+        self._write_chunk(b"pHYs", pixels_per_metre.to_bytes(4, "big") * 2 + b"\x01")
+        for key, value in (metadata or {}).items():
+            self._write_chunk(b"tEXt", str(key).encode("latin-1") + b"\0" + str(value).encode("latin-1", "replace"))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+
+    def _write_chunk(self, kind, data):
+        self._file.write(len(data).to_bytes(4, "big") + kind + data)
+        self._file.write(zlib.crc32(data, zlib.crc32(kind)).to_bytes(4, "big"))
+
+    def encode_rows(self, strip):
+        # Must be called in row order; returns (row count, deflated bytes).
+        if strip.width != self.size[0]:
+            raise ValueError("Strip width does not match the PNG width.")
+        pixels = np.asarray(strip.convert(self.mode), dtype=np.uint8).reshape(strip.height, -1)
+        # "Sub" filter: each byte minus the same channel of the pixel before.
+        filtered = pixels.copy()
+        filtered[:, self._channels:] -= pixels[:, :-self._channels]
+        rows = np.hstack((np.ones((strip.height, 1), dtype=np.uint8), filtered))
+        return strip.height, self._compressor.compress(rows.tobytes())
+
+    def write_rows(self, encoded):
+        row_count, data = encoded
+        self.rows_written += row_count
+        if data:
+            self._write_chunk(b"IDAT", data)
+
+    def add_rows(self, strip):
+        self.write_rows(self.encode_rows(strip))
+
+    def close(self):
+        if self._finished:
+            return
+        if self.rows_written != self.size[1]:
+            self.abort()
+            raise ValueError("PNG closed before all rows were written.")
+        self._finished = True
+        self._write_chunk(b"IDAT", self._compressor.flush())
+        self._write_chunk(b"IEND", b"")
+        self._file.close()
+        os.replace(self._temp_path, self.path)
+
+    def abort(self):
+        if self._finished:
+            return
+        self._finished = True
+        self._file.close()
+        try:
+            os.remove(self._temp_path)
+        except OSError:
+            pass
+
+
+# === PIPELINED PRINT PATH ===
+# The print outputs run as a chain of stages, each in its own thread and
+# connected by bounded queues: decode (+ dot detection) -> assemble pages once
+# their segments and guide rows are known -> compose/encode -> write. A full
+# queue blocks its producer, so at most PIPELINE_QUEUE_SIZE items wait between
+# stages and wall-clock time follows the slowest stage rather than the sum.
+#
+# Long runs take progress(stage, done, total) and a threading.Event; a set
+# event stops the run between segments and pages with OperationCancelled, and
+# the writers then drop their temporary files.
+PIPELINE_QUEUE_SIZE = 4
+_PIPELINE_DONE = object()
+_PIPELINE_ERROR = object()
+
+
+class OperationCancelled(Exception):
+    pass
+
+
+def check_cancelled(cancel_event):
+    if cancel_event is not None and cancel_event.is_set():
+        raise OperationCancelled("Cancelled")
+
+
+def report_progress(progress, stage, done, total):
+    if progress is not None:
+        progress(stage, done, total)
+
+
+def pipelined(iterable, maxsize=PIPELINE_QUEUE_SIZE):
+    # Runs iterable in a background thread and yields its items in order.
+    # Exceptions are re-raised in the consumer; closing the generator stops
+    # the producer and closes the iterable it was reading.
+    items = queue.Queue(maxsize)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        iterator = iter(iterable)
+        try:
+            for value in iterator:
+                if not put((None, value)):
+                    return
+            put((_PIPELINE_DONE, None))
+        except BaseException as exc:
+            put((_PIPELINE_ERROR, exc))
+        finally:
+            close = getattr(iterator, "close", None)
+            if close is not None:
+                close()
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    try:
+        while True:
+            kind, value = items.get()
+            if kind is _PIPELINE_DONE:
+                return
+            if kind is _PIPELINE_ERROR:
+                raise value
+            yield value
+    finally:
+        stop.set()
+        producer.join()
+
+
+def _settled_guide_rows(centers, frontier, y_tolerance):
+    # Dots still to come all lie at or below frontier, so only the last chain
+    # of dots (rows are split on gaps wider than the tolerance) can still
+    # change. Returns (final rows, first row position that may still change).
+    if frontier is None or not centers:
+        return group_guide_rows(centers, y_tolerance), frontier if frontier is not None else float("inf")
+    eps = max(1, int(abs(y_tolerance)))
+    ys = np.sort(np.asarray(centers)[:, 1])
+    if ys[-1] + eps < frontier:
+        return group_guide_rows(centers, y_tolerance), frontier
+    gaps = np.nonzero(np.diff(ys) > eps)[0]
+    chain_start = ys[gaps[-1] + 1] if len(gaps) else ys[0]
+    settled = [center for center in centers if center[1] < chain_start]
+    return group_guide_rows(settled, y_tolerance), chain_start
+
+
+def iter_assembled_windows(layout, decoded_segments, windows, line_settings=None, progress=None, cancel_event=None):
+    # windows are (top, bottom) source rows each output unit reads, in order.
+    # Consumes (image, dot pixels) per segment from decoded_segments and
+    # yields (images by segment index, guide rows) for each window as soon as
+    # every segment it touches is decoded and no later dot can change a guide
+    # line reaching into it. Images are dropped after the last window using them.
+    bounds = layout.segment_bounds
+    needed = [
+        [index for index, (start, end) in enumerate(bounds) if start < bottom and end > top]
+        for top, bottom in windows
+    ]
+    last_use = {}
+    for window_index, indices in enumerate(needed):
+        for index in indices:
+            last_use[index] = window_index
+
+    reach = 0
+    y_tolerance = 0
+    if line_settings is not None:
+        reach = max(0, line_settings[0]) + 1
+        y_tolerance = line_settings[1]
+    source = iter(decoded_segments)
+    images = {}
+    # Centres of finished dots, and the visible pixels of dots a segment still
+    # to come may join (all at or below open_top).
+    centers = []
+    open_pixels = NO_DOT_PIXELS
+    open_top = float("inf")
+    decoded = 0
+    rows = []
+    try:
+        for window_index, ((_, bottom), indices) in enumerate(zip(windows, needed)):
+            while decoded < len(bounds):
+                if not indices or indices[-1] < decoded:
+                    if line_settings is None:
+                        break
+                    frontier = min(bounds[decoded][0], open_top)
+                    rows, settled_limit = _settled_guide_rows(centers, frontier, y_tolerance)
+                    if settled_limit >= bottom + reach:
+                        break
+                check_cancelled(cancel_event)
+                if decoded in layout.spacers:
+                    image, dots = layout.segment_image(decoded), NO_DOT_PIXELS
+                else:
+                    image, dots = layout.trim_segment(decoded, *next(source))
+                report_progress(progress, "Decoded", decoded + 1, len(bounds))
+                if decoded in last_use:
+                    images[decoded] = image
+                if line_settings is not None:
+                    visible = visible_dot_pixels(decoded, dots if dots is not None else NO_DOT_PIXELS, bounds)
+                    next_start = bounds[decoded + 1][0] if decoded + 1 < len(bounds) else float("inf")
+                    settled, open_pixels, open_top = settle_dot_pixels(
+                        *_join_dot_pixels([open_pixels, visible]), next_start
+                    )
+                    centers.extend(settled)
+                decoded += 1
+            if line_settings is not None and decoded == len(bounds):
+                rows = group_guide_rows(centers, y_tolerance)
+            yield {index: images[index] for index in indices}, rows
+            for index in indices:
+                if last_use[index] == window_index:
+                    images.pop(index, None)
+    finally:
+        close = getattr(source, "close", None)
+        if close is not None:
+            close()
+
+
+def _pipeline_source(layout, line_settings, workers=DECODE_WORKERS, queue_size=PIPELINE_QUEUE_SIZE):
+    if line_settings is not None:
+        layout.line_thickness = line_settings[0]
+        layout.line_color = line_settings[2]
+    file_paths = [path for index, path in enumerate(layout.file_paths) if index not in layout.spacers]
+    decoded = iter_decoded_segments(file_paths, layout.color_mode, line_settings is not None, workers)
+    return pipelined(decoded, queue_size)
+
+
+def pipeline_layout_pdf(
+    layout,
+    save_path,
+    line_settings=None,
+    dpi=None,
+    color_mode="rgb",
+    bilevel_threshold=DEFAULT_BILEVEL_THRESHOLD,
+    vector_guides=True,
+    queue_size=PIPELINE_QUEUE_SIZE,
+    progress=None,
+    cancel_event=None,
+    profile=DEFAULT_EXPORT_PROFILE,
+):
+    # Same output as layout.connect(*line_settings) + write_layout_pdf, with
+    # detection done on the decoded segments as they stream through.
+    settings = export_profile(profile, dpi)
+    geometry, scale_factor, content_height, pages_meta = layout_pagination(layout, settings["dpi"])
+    windows = [page_window(layout, page, scale_factor, content_height) for page in pages_meta]
+
+    with profile_pdf_writer(save_path, settings, color_mode, bilevel_threshold) as writer:
+        assembled = pipelined(
+            iter_assembled_windows(
+                layout,
+                _pipeline_source(layout, line_settings, queue_size=queue_size),
+                windows,
+                line_settings,
+                progress,
+                cancel_event,
+            ),
+            queue_size,
+        )
+
+        def encode_pages():
+            try:
+                for page, (images, rows) in zip(pages_meta, assembled):
+                    yield direct_page_parts(layout, writer, page, geometry, scale_factor, vector_guides, images, rows)
+            finally:
+                assembled.close()
+
+        encoded_pages = pipelined(encode_pages(), queue_size)
+        try:
+            for parts in encoded_pages:
+                check_cancelled(cancel_event)
+                add_direct_page(writer, geometry, parts)
+                report_progress(progress, "Page", writer.page_count, len(pages_meta))
+        finally:
+            encoded_pages.close()
+        if writer.page_count == 0:
+            writer.abort()
+            return 0
+    return writer.page_count
+
+
+def pipeline_layout_a4_png(
+    layout,
+    save_path,
+    line_settings=None,
+    dpi=None,
+    queue_size=PIPELINE_QUEUE_SIZE,
+    progress=None,
+    cancel_event=None,
+    profile=DEFAULT_EXPORT_PROFILE,
+):
+    # Streams the stitched document onto one A4 PNG page in per-segment row
+    # bands; the page is laid out as in prepare_printable_a4.
+    settings = export_profile(profile, dpi)
+    dpi = settings["dpi"]
+    resample = settings["resample_filter"]
+    geometry = page_geometry(dpi)
+    page_width, page_height = geometry["page_size"]
+    margin_left = geometry["margin_left"]
+    margin_top = geometry["margin_top"]
+    scale_factor = content_scale(layout.width, dpi)
+    content_width = int(round(layout.width * scale_factor))
+    content_height = int(layout.height * scale_factor)
+    if content_height > geometry["printable_height"]:
+        raise PageOverflowError("Image too tall for A4 page with margins.")
+
+    strips = segment_row_strips(layout.segment_bounds, scale_factor, content_height)
+    windows = [page_source_window(layout, start, end, scale_factor, content_height) for start, end in strips]
+    page_mode = "L" if layout.color_mode == "L" else "RGB"
+
+    with PngStripWriter(
+        save_path,
+        (page_width, page_height),
+        page_mode,
+        dpi,
+        metadata=profile_metadata(settings),
+    ) as writer:
+        assembled = pipelined(
+            iter_assembled_windows(
+                layout,
+                _pipeline_source(layout, line_settings, queue_size=queue_size),
+                windows,
+                line_settings,
+                progress,
+                cancel_event,
+            ),
+            queue_size,
+        )
+
+        def padded_strip(start, end, images, rows):
+            content = scaled_layout_rows(
+                layout, start, end, content_width, scale_factor, content_height, images, rows, resample
+            )
+            strip = Image.new(page_mode, (page_width, end - start), "white")
+            strip.paste(content, (margin_left, 0))
+            return strip
+
+        def compose_strips():
+            # Segment bands are resampled in a thread pool, a few ahead of the
+            # one being handed on, and come back in order.
+            yield Image.new(page_mode, (page_width, margin_top), "white")
+            try:
+                with ThreadPoolExecutor(max_workers=max(1, RESAMPLE_WORKERS)) as pool:
+                    pending = deque()
+                    for (start, end), (images, rows) in zip(strips, assembled):
+                        pending.append(pool.submit(padded_strip, start, end, images, rows))
+                        if len(pending) > RESAMPLE_WORKERS:
+                            yield pending.popleft().result()
+                    while pending:
+                        yield pending.popleft().result()
+            finally:
+                assembled.close()
+            remaining = page_height - margin_top - content_height
+            if remaining > 0:
+                yield Image.new(page_mode, (page_width, remaining), "white")
+
+        def encode_strips():
+            composed = pipelined(compose_strips(), queue_size)
+            try:
+                for strip in composed:
+                    yield writer.encode_rows(strip)
+            finally:
+                composed.close()
+
+        encoded_strips = pipelined(encode_strips(), queue_size)
+        try:
+            for encoded in encoded_strips:
+                check_cancelled(cancel_event)
+                writer.write_rows(encoded)
+                report_progress(progress, "Rows", writer.rows_written, page_height)
+        finally:
+            encoded_strips.close()
+    return save_path
+
+
+# === DOCUMENT EXPORT ===
+# One call per document for scripts, the CLI and the GUI: the files are
+# stitched in the given order and written as a paginated PDF or a single A4
+# PNG. Problems are raised, never shown in a dialog.
+DEFAULT_LINE_SETTINGS = (7, 2, (0, 0, 0))
+EXPORT_FORMATS = ("pdf", "png")
+
+
+def export_document(
+    file_paths,
+    output_path,
+    output_format="pdf",
+    line_settings=DEFAULT_LINE_SETTINGS,
+    overlap_px=0,
+    color_mode="RGBA",
+    trim_padding=None,
+    pdf_color_mode="rgb",
+    bilevel_threshold=DEFAULT_BILEVEL_THRESHOLD,
+    profile=DEFAULT_EXPORT_PROFILE,
+    progress=None,
+    cancel_event=None,
+):
+    # line_settings=None stitches without guide lines. Returns the PDF's page
+    # count or the PNG's path.
+    if output_format not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown output format: {output_format}")
+    layout = StitchLayout(file_paths, overlap_px, color_mode, trim_padding)
+    check_cancelled(cancel_event)
+    if output_format == "png":
+        return pipeline_layout_a4_png(
+            layout, output_path, line_settings, progress=progress, cancel_event=cancel_event, profile=profile
+        )
+    page_count = pipeline_layout_pdf(
+        layout,
+        output_path,
+        line_settings,
+        color_mode=pdf_color_mode,
+        bilevel_threshold=bilevel_threshold,
+        progress=progress,
+        cancel_event=cancel_event,
+        profile=profile,
+    )
+    if not page_count:
+        raise ValueError("No printable pages generated.")
+    return page_count
@@ -0,0 +1,356 @@
+# Watch-folder front end for printable_core: exports land in one input
+# directory, and each document becomes a PDF as soon as all of its lines are
+# there, with the same settings and output as "Connect + Stitch + PDF".
+#
+#   python printable_watch.py exports --output-dir "for printing" --jobs 2
+#
+# Documents are grouped two ways:
+#   * Manifest: "<name>.manifest" lists the document's PNGs in order, one per
+#     line (blank lines and "#" comments are skipped). Entries name files in
+#     the watched directory; a manifest listing anything else is reported and
+#     skipped. The document is
+#     complete once every listed file exists and has stopped changing.
+#   * Naming convention: "<name>_<number>.png" (or "<name>-<number>.png"),
+#     ordered by number. The set is only complete once a "<name>.done"
+#     marker appears: a quiet folder cannot tell a finished set from a slow
+#     synthesis run. The marker may hold the number of lines; the document
+#     then waits for exactly that many, and an empty marker needs numbers
+#     without gaps.
+#
+# Polling is cheap: the directory is only listed when its mtime moves or files
+# are still settling, otherwise the files already seen are just stat'ed, and a
+# file counts as settled once its size and mtime hold for --settle seconds. Complete documents run in a process pool. An
+# existing PDF is never replaced; a later document of the same name is written
+# as "<name>-2.pdf" and so on. On success the sources, manifest and marker are
+# deleted (kept with --keep-sources, as in the GUI); a failed document is
+# retried only after one of its files changes.
+#
+# SIGINT and SIGTERM stop the watcher: documents that have not started are
+# reported as interrupted and left in place, running ones are allowed to
+# finish. Pool workers ignore SIGINT, so Ctrl-C in the terminal does not kill
+# them mid-document. Exits 1 if a document was interrupted, or with --once if
+# one failed.
+import argparse
+import os
+import re
+import signal
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from printable_cli import natural_key, parse_color
+from printable_core import (
+    DEFAULT_BILEVEL_THRESHOLD,
+    DEFAULT_LINE_SETTINGS,
+    EXPORT_PROFILES,
+    PDF_COLOR_MODES,
+    configure_one_shot_caches,
+    export_document,
+)
+
+LINE_NAME_PATTERN = re.compile(r"^(?P<document>.+?)[_-](?P<index>\d+)\.png$", re.IGNORECASE)
+MANIFEST_SUFFIX = ".manifest"
+DONE_SUFFIX = ".done"
+WATCH_POLL_SECONDS = 1.0
+WATCH_SETTLE_SECONDS = 2.0
+
+
+def read_manifest(path):
+    with open(path, encoding="utf-8") as handle:
+        lines = [line.strip() for line in handle]
+    return [line for line in lines if line and not line.startswith("#")]
+
+
+def read_marker(path):
+    # The line count a ".done" marker holds, or None for an empty marker.
+    with open(path, encoding="utf-8") as handle:
+        text = handle.read().strip()
+    return int(text) if text else None
+
+
+def unused_output_path(output_dir, document):
+    output_path = os.path.join(output_dir, document + ".pdf")
+    number = 2
+    while os.path.exists(output_path):
+        output_path = os.path.join(output_dir, f"{document}-{number}.pdf")
+        number += 1
+    return output_path
+
+
+def _init_worker():
+    # Ctrl-C reaches the whole process group; the parent decides what stops.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    configure_one_shot_caches()
+
+
+def export_watched_document(paths, output_path, settings):
+    # Runs in a pool worker.
+    page_count = export_document(paths, output_path, "pdf", **settings)
+    return f"{output_path}: {len(paths)} line(s), {page_count} page(s)"
+
+
+class FolderWatcher:
+    def __init__(
+        self,
+        input_dir,
+        output_dir,
+        settings,
+        jobs=1,
+        settle_seconds=WATCH_SETTLE_SECONDS,
+        keep_sources=False,
+    ):
+        self.input_dir = input_dir
+        self.output_dir = output_dir
+        self.settings = settings
+        self.jobs = max(1, jobs)
+        self.settle_seconds = settle_seconds
+        self.keep_sources = keep_sources
+        # name -> (size, mtime_ns, time the signature was first seen)
+        self._files = {}
+        self._dir_mtime = None
+        # document -> signature of the files it was last run (or failed) with
+        self._finished = {}
+        self._running = {}
+        self._warned = set()
+
+    def _scan(self, now):
+        # Lists the directory only when something may have changed.
+        try:
+            dir_mtime = os.stat(self.input_dir).st_mtime_ns
+        except OSError as exc:
+            raise ValueError(f"Cannot watch {self.input_dir}: {exc}")
+        unsettled = any(now - seen < self.settle_seconds for _, _, seen in self._files.values())
+        if dir_mtime == self._dir_mtime and not unsettled:
+            # A file rewritten in place leaves the directory mtime alone, so
+            # the known files are still stat'ed.
+            names = list(self._files)
+        else:
+            self._dir_mtime = dir_mtime
+            names = [entry.name for entry in os.scandir(self.input_dir) if entry.is_file()]
+        files = {}
+        for name in names:
+            try:
+                stat = os.stat(os.path.join(self.input_dir, name))
+            except OSError:
+                continue
+            previous = self._files.get(name)
+            if previous is not None and previous[:2] == (stat.st_size, stat.st_mtime_ns):
+                files[name] = previous
+            else:
+                files[name] = (stat.st_size, stat.st_mtime_ns, now)
+        self._files = files
+
+    def _warn(self, document, message):
+        if document not in self._warned:
+            self._warned.add(document)
+            print(f"waiting: {message}", flush=True)
+
+    def _manifest_names(self, document, manifest, lines):
+        # Manifest entries as names in input_dir ("./a.png" and absolute paths
+        # into it are fine); None after a warning if any lies elsewhere.
+        input_dir = os.path.normcase(os.path.abspath(self.input_dir))
+        names = []
+        for line in lines:
+            path = os.path.abspath(os.path.join(self.input_dir, line))
+            if os.path.normcase(os.path.dirname(path)) != input_dir:
+                self._warn(document, f"{manifest} lists {line}, which is not a file in {self.input_dir}")
+                return None
+            names.append(os.path.basename(path))
+        return names
+
+    def _documents(self, now, force=False):
+        # [(document, [names], [extra names])] that are complete right now;
+        # force skips the settle wait.
+        def settled(name):
+            entry = self._files.get(name)
+            return entry is not None and (force or now - entry[2] >= self.settle_seconds)
+
+        documents = []
+        claimed = set()
+        for name in sorted(self._files, key=natural_key):
+            if not name.endswith(MANIFEST_SUFFIX):
+                continue
+            try:
+                lines = read_manifest(os.path.join(self.input_dir, name))
+            except (OSError, UnicodeDecodeError):
+                continue
+            document = name[: -len(MANIFEST_SUFFIX)]
+            names = self._manifest_names(document, name, lines)
+            if names is None:
+                continue
+            # Listed files never fall back to the naming convention, even
+            # while the manifest is still being written.
+            claimed.update(names)
+            if settled(name) and names and all(settled(line) for line in names):
+                documents.append((document, names, [name]))
+
+        groups = {}
+        for name in self._files:
+            match = LINE_NAME_PATTERN.match(name)
+            if match and name not in claimed:
+                groups.setdefault(match.group("document"), []).append((int(match.group("index")), name))
+        for document, numbered in sorted(groups.items(), key=lambda item: natural_key(item[0])):
+            marker = document + DONE_SUFFIX
+            if marker not in self._files:
+                self._warn(document, f"{document} is complete once {marker} appears")
+                continue
+            numbered.sort()
+            names = [name for _, name in numbered]
+            if not settled(marker) or not all(settled(name) for name in names):
+                continue
+            try:
+                expected = read_marker(os.path.join(self.input_dir, marker))
+            except (OSError, UnicodeDecodeError, ValueError):
+                self._warn(document, f"{marker} must be empty or hold the number of lines")
+                continue
+            if expected is not None:
+                if len(names) != expected:
+                    self._warn(document, f"{document} has {len(names)} of {expected} line(s)")
+                    continue
+            else:
+                indices = [index for index, _ in numbered]
+                if indices != list(range(indices[0], indices[0] + len(indices))):
+                    self._warn(document, f"{document} has gaps in its line numbers")
+                    continue
+            documents.append((document, names, [marker]))
+        return documents
+
+    def _signature(self, names):
+        return tuple((name,) + self._files[name][:2] for name in names)
+
+    def poll(self, pool, now=None, force=False):
+        # Scans once and submits every complete document that is not already
+        # running or finished with the same files.
+        now = time.monotonic() if now is None else now
+        self._scan(now)
+        for document, names, extras in self._documents(now, force):
+            signature = self._signature(names)
+            if document in self._running or self._finished.get(document) == signature:
+                continue
+            paths = [os.path.join(self.input_dir, name) for name in names]
+            output_path = unused_output_path(self.output_dir, document)
+            future = pool.submit(export_watched_document, paths, output_path, self.settings)
+            self._running[document] = (future, signature, paths, extras)
+            print(f"queued: {document} ({len(paths)} line(s))", flush=True)
+
+    def collect(self, wait=False):
+        # Handles finished documents; returns how many failed.
+        failures = 0
+        for document, (future, signature, paths, extras) in list(self._running.items()):
+            if not wait and not future.done():
+                continue
+            del self._running[document]
+            self._finished[document] = signature
+            self._warned.discard(document)
+            try:
+                print(f"done: {future.result()}", flush=True)
+            except Exception as exc:
+                failures += 1
+                print(f"error: {document}: {exc}", file=sys.stderr, flush=True)
+                continue
+            if not self.keep_sources:
+                for path in paths + [os.path.join(self.input_dir, name) for name in extras]:
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+        return failures
+
+    def cancel_pending(self):
+        # Cancels documents that have not started; they are not marked
+        # finished, so the next run picks them up. Returns how many.
+        interrupted = 0
+        for document, (future, _, _, _) in list(self._running.items()):
+            if future.cancel():
+                del self._running[document]
+                interrupted += 1
+                print(f"interrupted: {document} was not started", file=sys.stderr, flush=True)
+        return interrupted
+
+    def run(self, poll_interval=WATCH_POLL_SECONDS, stop_event=None, once=False):
+        # Returns (failed, interrupted) document counts. once processes what
+        # is complete now, without the settle wait, and returns when it is
+        # done. After stop_event, running documents still finish.
+        os.makedirs(self.output_dir, exist_ok=True)
+        stop_event = stop_event or threading.Event()
+        failures = 0
+        with ProcessPoolExecutor(max_workers=self.jobs, initializer=_init_worker) as pool:
+            try:
+                if once:
+                    self.poll(pool, force=True)
+                while not stop_event.is_set() and (self._running or not once):
+                    if not once:
+                        self.poll(pool)
+                    failures += self.collect()
+                    running = [future for future, _, _, _ in self._running.values()]
+                    if running:
+                        wait(running, poll_interval, FIRST_COMPLETED)
+                    else:
+                        stop_event.wait(poll_interval)
+            finally:
+                interrupted = self.cancel_pending()
+                failures += self.collect(wait=True)
+        return failures, interrupted
+
+
+def build_parser():
+    thickness, tolerance, color = DEFAULT_LINE_SETTINGS
+    parser = argparse.ArgumentParser(description="Turn handwriting line PNGs into PDFs as they land in a folder.")
+    parser.add_argument("input_dir", help="directory the synthesis exports are saved to")
+    parser.add_argument("--output-dir", required=True, help="directory the PDFs are written to")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1, help="documents processed at once")
+    parser.add_argument("--poll", type=float, default=WATCH_POLL_SECONDS, help="seconds between scans")
+    parser.add_argument("--settle", type=float, default=WATCH_SETTLE_SECONDS, help="seconds a file must stay unchanged")
+    parser.add_argument("--once", action="store_true", help="process complete documents once and exit")
+    parser.add_argument("--keep-sources", action="store_true", help="keep input files after a successful export")
+    parser.add_argument("--no-connect", action="store_true", help="stitch without drawing guide lines")
+    parser.add_argument("--thickness", type=int, default=thickness, help="guide line thickness in px")
+    parser.add_argument("--tolerance", type=int, default=tolerance, help="vertical tolerance for guide rows in px")
+    parser.add_argument("--color", type=parse_color, default=color, help="guide line colour as R,G,B")
+    parser.add_argument("--overlap", type=int, default=0, help="overlap between lines in px")
+    parser.add_argument("--grayscale", action="store_true", help="run the pipeline in grayscale")
+    parser.add_argument("--trim", type=int, metavar="PADDING", help="trim line margins, keeping PADDING px")
+    parser.add_argument("--pdf-color", choices=PDF_COLOR_MODES, default="rgb", help="PDF image colour mode")
+    parser.add_argument("--threshold", type=int, default=DEFAULT_BILEVEL_THRESHOLD, help="bilevel PDF threshold")
+    parser.add_argument("--profile", choices=sorted(EXPORT_PROFILES), default="final", help="export profile")
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+    if not os.path.isdir(args.input_dir):
+        parser.error(f"not a directory: {args.input_dir}")
+
+    settings = {
+        "line_settings": None if args.no_connect else (args.thickness, args.tolerance, args.color),
+        "overlap_px": max(0, args.overlap),
+        "color_mode": "L" if args.grayscale else "RGBA",
+        "trim_padding": None if args.trim is None else max(0, args.trim),
+        "pdf_color_mode": args.pdf_color,
+        "bilevel_threshold": args.threshold,
+        "profile": args.profile,
+    }
+    watcher = FolderWatcher(args.input_dir, args.output_dir, settings, args.jobs, args.settle, args.keep_sources)
+    stop_event = threading.Event()
+
+    def stop(*_):
+        if not stop_event.is_set():
+            print("stopping: letting running documents finish", file=sys.stderr, flush=True)
+        stop_event.set()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    try:
+        failures, interrupted = watcher.run(args.poll, stop_event, args.once)
+    except ValueError as exc:
+        print(f"error: {exc}", file=sys.stderr)
+        return 1
+    return 1 if interrupted or (args.once and failures) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
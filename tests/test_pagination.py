@@ -0,0 +1,54 @@
+import random
+
+import pytest
+
+from printable_core import PageOverflowError, compute_segment_bounds, paginate_segments
+
+PRINTABLE_HEIGHT = 1000
+
+
+def random_layout(seed):
+    rnd = random.Random(seed)
+    heights = [rnd.randint(20, 400) for _ in range(rnd.randint(1, 60))]
+    spacers = {index for index in range(len(heights)) if rnd.random() < 0.2}
+    bounds = compute_segment_bounds(heights, rnd.randint(0, 15))
+    content_height = max(end for _, end in bounds)
+    return bounds, content_height, spacers
+
+
+@pytest.mark.parametrize("seed", range(50))
+def test_pages_fit_and_keep_every_line_once_in_order(seed):
+    bounds, content_height, spacers = random_layout(seed)
+    pages = paginate_segments(bounds, content_height, PRINTABLE_HEIGHT, spacers)
+
+    placed = [index for _, _, segments in pages for _, _, index in segments if index not in spacers]
+    assert placed == [index for index in range(len(bounds)) if index not in spacers]
+    for page_start, page_end, segments in pages:
+        assert segments
+        assert page_end - page_start <= PRINTABLE_HEIGHT
+        assert page_start == segments[0][0]
+        assert page_end == max(end for _, end, _ in segments)
+        # Spacers only ever sit between lines on a page.
+        assert segments[0][2] not in spacers
+        assert segments[-1][2] not in spacers
+    starts = [page_start for page_start, _, _ in pages]
+    assert starts == sorted(starts)
+
+
+def test_only_spacers_gives_no_pages():
+    bounds = compute_segment_bounds([50, 60, 70])
+    assert paginate_segments(bounds, 180, PRINTABLE_HEIGHT, spacers={0, 1, 2}) == []
+
+
+def test_breaks_at_a_spacer_once_the_page_is_full_enough():
+    # Lines 0, 1 and 3 would fit on the first page, but the spacer after
+    # line 1 comes past PAGE_BREAK_MIN_FILL, so the paragraph moves over.
+    bounds = compute_segment_bounds([350, 350, 40, 200, 200])
+    pages = paginate_segments(bounds, bounds[-1][1], PRINTABLE_HEIGHT, spacers={2})
+    assert [[index for _, _, index in segments] for _, _, segments in pages] == [[0, 1], [3, 4]]
+
+
+def test_line_taller_than_the_page_raises():
+    bounds = compute_segment_bounds([200, PRINTABLE_HEIGHT + 1, 200])
+    with pytest.raises(PageOverflowError):
+        paginate_segments(bounds, bounds[-1][1], PRINTABLE_HEIGHT)
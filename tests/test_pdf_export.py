@@ -0,0 +1,64 @@
+import random
+
+import pytest
+from PIL import Image, ImageDraw
+
+import printable_core
+from printable_core import StitchLayout, pipeline_layout_pdf, write_layout_pdf
+
+LINE_SETTINGS = (5, 2, (0, 0, 0))
+
+
+@pytest.fixture(autouse=True)
+def one_shot_caches():
+    # Keep decodes out of the user's disk cache and start every test cold.
+    printable_core.configure_one_shot_caches()
+    printable_core.stage_cache.clear()
+
+
+def write_line(path, seed, width=1600, height=220):
+    rnd = random.Random(seed)
+    image = Image.new("RGBA", (width, height), (255, 255, 255, 0))
+    draw = ImageDraw.Draw(image)
+    for _ in range(25):
+        x, y = rnd.randint(40, width - 120), rnd.randint(20, height - 40)
+        draw.line([(x, y), (x + rnd.randint(10, 80), y + rnd.randint(-20, 20))], fill=(0, 0, 0, 255), width=3)
+    y = height // 2 + rnd.randint(-5, 5)
+    for x in range(100, width - 100, rnd.randint(150, 300)):
+        r = rnd.randint(3, 6)
+        draw.ellipse([x - r, y - r, x + r, y + r], fill=(250, 220, 10, 255))
+    image.save(path)
+    return str(path)
+
+
+@pytest.fixture
+def line_files(tmp_path):
+    paths = [write_line(tmp_path / f"line_{index:03d}.png", index) for index in range(30)]
+    # Blank paragraph spacers between some of the lines.
+    for index in (6, 17, 25):
+        spacer = tmp_path / f"spacer_{index:03d}.png"
+        Image.new("RGBA", (1600, 220), (255, 255, 255, 0)).save(spacer)
+        paths.insert(index, str(spacer))
+    return paths
+
+
+@pytest.mark.parametrize(
+    "profile, color_mode, overlap",
+    [("final", "rgb", 20), ("draft", "gray", 0), ("final", "bilevel", 35)],
+)
+def test_pipeline_matches_sequential_export(tmp_path, line_files, profile, color_mode, overlap):
+    layout = StitchLayout(line_files, overlap)
+    assert layout.spacers
+    layout.connect(*LINE_SETTINGS)
+    assert layout.guide_rows
+    sequential_path = tmp_path / "sequential.pdf"
+    sequential_pages = write_layout_pdf(layout, str(sequential_path), color_mode=color_mode, profile=profile)
+
+    printable_core.stage_cache.clear()
+    pipeline_path = tmp_path / "pipeline.pdf"
+    pipeline_pages = pipeline_layout_pdf(
+        StitchLayout(line_files, overlap), str(pipeline_path), LINE_SETTINGS, color_mode=color_mode, profile=profile
+    )
+
+    assert sequential_pages == pipeline_pages > 1
+    assert sequential_path.read_bytes() == pipeline_path.read_bytes()